@@ -0,0 +1,273 @@
+import math
+import numpy as np
+
+
+class Amortization:
+    """ Closed-form amortization engine
+    Computes loan schedules with NumPy instead of stepping one month at a time. Every method broadcasts over its
+    inputs, so the same code serves a single loan, a block of periods, or many loans laid out as a 2-D array.
+    """
+    COLUMNS = ['Payment Number', 'Begin Principal', 'Payment', 'Extra Payment',
+               'Applied Principal', 'Applied Interest', 'End Principal']
+    RATE_SCALE = 10 ** 4  # cents engine: rates are exact to 1/RATE_SCALE of a percent
+
+    @staticmethod
+    def periodic_rate(rate):
+        """ Convert an annualized percentage rate into a monthly rate.
+            :param rate: annualized interest rate as a percentage
+            :return: monthly interest rate as a fraction
+        """
+        return np.asarray(rate, dtype=np.float64) / 12.0 / 100.0
+
+    @staticmethod
+    def growth(periods, r):
+        """ Return ((1 + r) ** periods - 1) / r, which is equal to periods when r is 0.
+            :param periods: number of elapsed periods
+            :param r: monthly interest rate as a fraction
+            :return: accumulation factor of a unit payment stream
+        """
+        periods = np.asarray(periods, dtype=np.float64)
+        r = np.asarray(r, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            factor = np.expm1(periods * np.log1p(r)) / r
+        return np.where(r == 0.0, periods, factor)
+
+    @staticmethod
+    def balance(principal, r, total_payment, periods):
+        """ Return the principal left after a number of full payments.
+            :param principal: principal amount at the start of the schedule
+            :param r: monthly interest rate as a fraction
+            :param total_payment: payment plus extra payment made every period
+            :param periods: number of payments made
+            :return: principal left on the loan
+        """
+        principal = np.asarray(principal, dtype=np.float64)
+        return principal - (total_payment - r * principal) * Amortization.growth(periods, r)
+
+    @staticmethod
+    def term(principal, rate, payment, extra_payment=0.0):
+        """ Return the number of payments needed to pay off the loan.
+            :param principal: principal amount left on the loan
+            :param rate: annualized interest rate as a percentage
+            :param payment: minimum expected payment
+            :param extra_payment: additional payment applied to the principal
+            :return: number of payments, 0 when there is no principal, -1 when payments never cover the interest
+        """
+        principal = np.asarray(principal, dtype=np.float64)
+        r = Amortization.periodic_rate(rate)
+        total_payment = np.asarray(payment, dtype=np.float64) + extra_payment
+        first_reduction = total_payment - r * principal
+        amortizing = first_reduction > 0.0
+
+        # the last payment is made in the first period whose balance plus interest no longer exceeds the payment
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            last = np.where(r > 0.0,
+                            np.log(total_payment / ((1.0 + r) * first_reduction)) / np.log1p(r),
+                            principal / total_payment - 1.0)
+        last = np.maximum(np.ceil(np.where(amortizing, last, 0.0)), 0.0)
+
+        # the logarithm can land one period off near integer boundaries, settle it on the balances themselves
+        def is_last(periods):
+            return Amortization.balance(principal, r, total_payment, periods) * (1.0 + r) <= total_payment
+
+        last = np.where(is_last(last), last, last + 1.0)
+        last = np.where((last > 0.0) & is_last(last - 1.0), last - 1.0, last)
+
+        term = np.where(amortizing, last + 1.0, -1.0).astype(np.int64)
+        return np.where(principal > 0.0, term, 0)
+
+    @staticmethod
+    def single_term(principal, rate, payment, extra_payment=0.0):
+        """ Same as term() for a single loan, with math instead of NumPy, whose fixed cost per call dominates for
+        one loan.
+            :return: number of payments as an int, as returned by term()
+        """
+        if principal <= 0.0:
+            return 0
+        r = rate / 12.0 / 100.0
+        total_payment = payment + extra_payment
+        first_reduction = total_payment - r * principal
+        if first_reduction <= 0.0:
+            return -1
+
+        if r > 0.0:
+            last = math.log(total_payment / ((1.0 + r) * first_reduction)) / math.log1p(r)
+        else:
+            last = principal / total_payment - 1.0
+        last = max(math.ceil(last), 0)
+
+        def is_last(periods):
+            growth = math.expm1(periods * math.log1p(r)) / r if r > 0.0 else periods
+            return (principal - first_reduction * growth) * (1.0 + r) <= total_payment
+
+        if not is_last(last):
+            last += 1
+        if last > 0 and is_last(last - 1):
+            last -= 1
+        return last + 1
+
+    @staticmethod
+    def summary(principal, rate, payment, extra_payment=0.0):
+        """ Compute schedule totals without computing the schedule.
+            :param principal: principal amount left on the loan
+            :param rate: annualized interest rate as a percentage
+            :param payment: minimum expected payment
+            :param extra_payment: additional payment applied to the principal
+            :return: number of payments as returned by term(), total interest paid, total principal paid
+        """
+        principal = np.asarray(principal, dtype=np.float64)
+        rate = np.asarray(rate, dtype=np.float64)
+        total_payment = np.asarray(payment, dtype=np.float64) + extra_payment
+        term = Amortization.term(principal, rate, payment, extra_payment)
+
+        # every payment but the last is paid in full, the last one settles the balance and its interest
+        full_payments = np.maximum(term - 1, 0)
+        last_principal = Amortization.balance(principal, Amortization.periodic_rate(rate), total_payment, full_payments)
+        last_interest = last_principal * rate / 12.0 / 100.0
+        total_interest_paid = full_payments * total_payment - (principal - last_principal) + last_interest
+
+        total_interest_paid = np.where(term > 0, total_interest_paid, np.where(term == 0, 0.0, np.nan))
+        total_principal_paid = np.where(term > 0, principal, np.where(term == 0, 0.0, np.nan))
+        return term, total_interest_paid, total_principal_paid
+
+    @staticmethod
+    def columns(principal, rate, payment, extra_payment, periods, term):
+        """ Compute schedule columns for the given payment numbers.
+            :param principal: principal amount left on the loan
+            :param rate: annualized interest rate as a percentage
+            :param payment: minimum expected payment
+            :param extra_payment: additional payment applied to the principal
+            :param periods: payment numbers to compute, starting at 1
+            :param term: number of payments, as returned by term()
+            :return: list of arrays in the order of COLUMNS, zero for payment numbers past the term
+        """
+        rate = np.asarray(rate, dtype=np.float64)
+        payment = np.asarray(payment, dtype=np.float64)
+        extra_payment = np.asarray(extra_payment, dtype=np.float64)
+        periods = np.asarray(periods)
+        r = Amortization.periodic_rate(rate)
+
+        # balances past the term are not used, and can overflow for loans that are paid off early
+        begin_principal = Amortization.balance(principal, r, payment + extra_payment,
+                                               np.clip(periods, 1, np.maximum(term, 1)) - 1)
+        applied_interest = begin_principal * rate / 12.0 / 100.0
+
+        # last period: pay off what is left, spilling into the extra payment only if the payment is not enough
+        last = periods == term
+        owed = begin_principal + applied_interest
+        last_payment = np.minimum(payment, owed)
+        payment = np.where(last, last_payment, payment)
+        extra_payment = np.where(last, owed - last_payment, extra_payment)
+
+        applied_principal = np.where(last, begin_principal, payment - applied_interest + extra_payment)
+        end_principal = begin_principal - applied_principal
+
+        active = (periods >= 1) & (periods <= term)
+        return [np.where(active, column, 0.0) for column in
+                (periods, begin_principal, payment, extra_payment, applied_principal, applied_interest, end_principal)]
+
+    @staticmethod
+    def single_columns(principal, rate, payment, extra_payment, term):
+        """ Same as columns() for every period of a single loan, written straight into one array.
+            :param term: number of payments, as returned by single_term(), at least 1
+            :return: array of shape (len(COLUMNS), term)
+        """
+        r = rate / 12.0 / 100.0
+        block = np.empty((len(Amortization.COLUMNS), term))
+        periods, begin_principal, payment_column, extra_column, applied_principal, applied_interest, end_principal = block
+        periods[:] = np.arange(1, term + 1)
+
+        np.subtract(periods, 1.0, out=begin_principal)
+        if r > 0.0:
+            np.multiply(begin_principal, math.log1p(r), out=begin_principal)
+            np.expm1(begin_principal, out=begin_principal)
+            np.divide(begin_principal, r, out=begin_principal)
+        np.multiply(begin_principal, payment + extra_payment - r * principal, out=begin_principal)
+        np.subtract(principal, begin_principal, out=begin_principal)
+        np.multiply(begin_principal, rate, out=applied_interest)
+        applied_interest /= 12.0
+        applied_interest /= 100.0
+
+        payment_column[:] = payment
+        extra_column[:] = extra_payment
+        np.subtract(payment, applied_interest, out=applied_principal)
+        applied_principal += extra_payment
+
+        # last period: pay off what is left, spilling into the extra payment only if the payment is not enough
+        owed = begin_principal[-1] + applied_interest[-1]
+        payment_column[-1] = min(payment, owed)
+        extra_column[-1] = owed - payment_column[-1]
+        applied_principal[-1] = begin_principal[-1]
+        np.subtract(begin_principal, applied_principal, out=end_principal)
+        return block
+
+    @staticmethod
+    def round_half_even(numerator, denominator):
+        """ Divide integers, rounding halves to the even neighbour (banker's rounding).
+            :param numerator: int64 array
+            :param denominator: positive integer
+            :return: int64 array
+        """
+        quotient, remainder = np.divmod(numerator, denominator)
+        up = (2 * remainder > denominator) | ((2 * remainder == denominator) & (quotient % 2 == 1))
+        return quotient + up
+
+    @staticmethod
+    def cents_columns(principal, rate, payment, extra_payment=0.0):
+        """ Compute exact schedules in integer cents. Every period's interest is rounded to the cent with banker's
+        rounding, and the last payment absorbs whatever is left, so the columns add up to the cent like a statement.
+        Rounding makes each period depend on the previous one, so periods are stepped in turn while all loans advance
+        together as arrays.
+            :param principal: principal amount left on each loan
+            :param rate: annualized interest rate of each loan as a percentage
+            :param payment: minimum expected payment of each loan
+            :param extra_payment: additional payment applied to the principal of each loan
+            :return: number of payments as int64 array (-1 when payments never cover the interest), and list of
+            (loans, periods) int64 arrays in the order of COLUMNS, money in cents, zero past each loan's term
+        """
+        principal, rate, payment, extra_payment = np.broadcast_arrays(
+            np.ravel(principal), np.ravel(rate), np.ravel(payment), np.ravel(extra_payment))
+        balance = np.rint(np.asarray(principal, dtype=np.float64) * 100).astype(np.int64)
+        rate = np.rint(np.asarray(rate, dtype=np.float64) * Amortization.RATE_SCALE).astype(np.int64)
+        payment = np.rint(np.asarray(payment, dtype=np.float64) * 100).astype(np.int64)
+        extra_payment = np.rint(np.asarray(extra_payment, dtype=np.float64) * 100).astype(np.int64)
+        if np.any(balance.astype(np.float64) * rate >= np.iinfo(np.int64).max):
+            raise ValueError('Principal and rate are too large for the cents engine')
+        denominator = 12 * 100 * Amortization.RATE_SCALE
+
+        # loans whose first payment does not cover the interest never terminate
+        term = np.zeros(len(balance), dtype=np.int64)
+        never = payment + extra_payment <= Amortization.round_half_even(balance * rate, denominator)
+        term[never & (balance > 0)] = -1
+
+        # step only the loans still running, writing each period into arrays sized from the closed-form term
+        estimate = Amortization.term(principal, rate / Amortization.RATE_SCALE, payment / 100.0, extra_payment / 100.0)
+        columns = np.zeros((len(Amortization.COLUMNS), len(balance), max(int(estimate.max(initial=0)) + 2, 1)),
+                           dtype=np.int64)
+        index = np.flatnonzero((balance > 0) & (term == 0))
+        balance, rate, payment, extra_payment = balance[index], rate[index], payment[index], extra_payment[index]
+        period = 0
+        while len(index) > 0:
+            if period == columns.shape[2]:
+                columns = np.concatenate([columns, np.zeros_like(columns)], axis=2)
+            applied_interest = Amortization.round_half_even(balance * rate, denominator)
+
+            # last period: pay off what is left, spilling into the extra payment only if the payment is not enough
+            owed = balance + applied_interest
+            last = owed <= payment + extra_payment
+            period_payment = np.where(last, np.minimum(payment, owed), payment)
+            period_extra_payment = np.where(last, owed - period_payment, extra_payment)
+            applied_principal = np.where(last, balance, payment + extra_payment - applied_interest)
+            end_principal = balance - applied_principal
+
+            for column, value in enumerate((period + 1, balance, period_payment, period_extra_payment,
+                                            applied_principal, applied_interest, end_principal)):
+                columns[column, index, period] = value
+            term[index[last]] = period + 1
+
+            running = ~last
+            index, balance = index[running], end_principal[running]
+            rate, payment, extra_payment = rate[running], payment[running], extra_payment[running]
+            period += 1
+
+        return term, list(columns[:, :, :max(int(term.max(initial=0)), 0)])
@@ -1,13 +1,17 @@
-from prettytable import PrettyTable
-import matplotlib.pyplot as plt
+import io
+import sys
 import numpy as np
-import decimal
-import pandas as pd
+import operator
+from algorithms.Schedule import Schedule
 
 
 class Helper:
     """ Helper class for printing and plotting of loan schedules.
+    matplotlib, PrettyTable and pandas are imported on first use, so that importing Helper stays cheap.
     """
+    FILTER_OPERATORS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+                        '=': operator.eq, '!=': operator.ne}
+
     @staticmethod
     def display(value, digits=2):
         """ Return a displayable value with a specified number of digits.
@@ -15,20 +19,27 @@ class Helper:
         :param digits: number of digits right of the decimal place
         :return: formatted displayable value
         """
-        temp = str(decimal.Decimal(str(value) + '0' * digits))
-        return temp[:temp.find('.') + digits + 1]
+        return str(Helper.format_column([value], digits, separator='')[0])
+
+    @staticmethod
+    def format_column(values, digits=2, separator=','):
+        """ Format a whole column of numbers at once, rounded to fixed decimals with thousands separators.
+        :param values: array of numbers
+        :param digits: number of digits right of the decimal place, 0 for integers
+        :param separator: thousands separator, '' for none
+        :return: array of str
+        """
+        text = Helper._format_bytes(values, digits, separator, width=1)
+        text = text.view('S{}'.format(text.shape[1])).ravel()
+        return np.char.strip(text.astype(str) if separator.isascii() else np.char.decode(text, 'utf-8'))
 
     @staticmethod
     def plot(loan):
-        payment_number, applied_principal, applied_interest, end_principal = [], [], [], []
+        import matplotlib.pyplot as plt
 
-        # iterate over the loan schedule
-        #
-        for pay in loan.schedule.values():
-            payment_number.append(pay[0])
-            applied_principal.append(pay[4])
-            applied_interest.append(pay[5])
-            end_principal.append(pay[6])
+        payment_number = loan.schedule.payment_number
+        applied_principal = loan.schedule.applied_principal
+        applied_interest = loan.schedule.applied_interest
 
         ind = np.arange(len(payment_number))
         width = 0.35
@@ -44,28 +55,231 @@ class Helper:
 
     @staticmethod
     def print(loan):
+        from prettytable import PrettyTable
+
         x = PrettyTable()
-        x.field_names = ['Payment Number', 'Begin Principal', 'Payment', 'Extra Payment',
-                         'Applied Principal', 'Applied Interest', 'End Principal']
+        x.field_names = Schedule.COLUMNS
         for field_name in x.field_names:
             x.align[field_name] = "r"
-        for pay in loan.schedule.values():
-            x.add_row([pay[0],
-                       Helper.display(pay[1]),
-                       Helper.display(pay[2]),
-                       Helper.display(pay[3]),
-                       Helper.display(pay[4]),
-                       Helper.display(pay[5]),
-                       Helper.display(pay[6])])
+        x.add_rows(np.stack(Helper._formatted_columns(loan.schedule.data), axis=1).tolist())
         print(x)
-    
+
+    @staticmethod
+    def write_table(loan, file=None, chunk_size=10000, digits=2):
+        """ Write the schedule of a loan or portfolio as a text table like print, chunk by chunk, for schedules too
+        long to hold in a PrettyTable.
+        :param loan: loan or portfolio with a computed schedule
+        :param file: text file to write to, sys.stdout if None
+        :param chunk_size: number of rows formatted at a time
+        :param digits: number of digits right of the decimal place of money columns
+        """
+        file = file or sys.stdout
+        for text in Helper.iter_table(loan.schedule, chunk_size, digits):
+            file.write(text)
+
+    @staticmethod
+    def iter_table(schedule, chunk_size=10000, digits=2):
+        """ Generate a schedule as a text table chunk by chunk. Column widths come from the largest values, so every
+        chunk lines up without formatting the whole schedule first.
+        :param schedule: Schedule
+        :param chunk_size: number of rows per chunk
+        :param digits: number of digits right of the decimal place of money columns
+        :return: generator of text, the header first
+        """
+        data = schedule.data
+        extremes = np.stack([data.min(axis=1, initial=0.0), data.max(axis=1, initial=0.0)], axis=1)
+        widths = [max(len(name), len(Helper._format_bytes(column, digits if i > 0 else 0, ',' if i > 0 else '')[0]))
+                  for i, (name, column) in enumerate(zip(Schedule.COLUMNS, extremes))]
+        border = '+' + '+'.join('-' * (width + 2) for width in widths) + '+\n'
+        yield border + '| ' + ' | '.join(name.center(width) for name, width in zip(Schedule.COLUMNS, widths)) + \
+            ' |\n' + border
+        for start in range(0, data.shape[1], chunk_size):
+            block = data[:, start:start + chunk_size]
+            columns = [Helper._format_bytes(block[0], 0, '', widths[0])] + \
+                      [Helper._format_bytes(column, digits, ',', width) for column, width in zip(block[1:], widths[1:])]
+            yield Helper._join_bytes(columns, b' | ', b'| ', b' |\n').decode('utf-8')
+        yield border
+
+    @staticmethod
+    def schedule_as_df(loan, records=False, digits=None):
+        """ Return the schedule of a loan or portfolio, built in one shot from the schedule columns.
+        :param loan: loan or portfolio with a computed schedule
+        :param records: if True, return a list of row dictionaries, ready for dash_table, without building a DataFrame
+        :param digits: number of digits to round money columns to, no rounding if None
+        :return: DataFrame with an int payment number and float64 money columns, or list of row dictionaries
+        """
+        columns = Helper._schedule_columns(loan.schedule, digits)
+        if records:
+            return Helper._records(columns)
+        import pandas as pd
+
+        return pd.DataFrame(columns, columns=Schedule.COLUMNS)
+
+    @staticmethod
+    def schedule_page(loan, page_current, page_size, sort_by=None, filters=None, digits=None):
+        """ Return one page of the schedule of a loan or portfolio, filtered and sorted on the schedule columns.
+        Only the rows of the page are turned into records, whatever the length of the schedule.
+        :param loan: loan or portfolio with a computed schedule
+        :param page_current: page number, starting at 0
+        :param page_size: number of rows per page
+        :param sort_by: list of (column name, ascending) pairs, the first pair sorts first
+        :param filters: list of (column name, operator, value) triples, operators as in FILTER_OPERATORS
+        :param digits: number of digits money columns are displayed with, filters compare values rounded to it, no
+        rounding if None; records keep the full values, for the table to format
+        :return: list of row dictionaries of the page, number of rows left after filtering
+        """
+        columns = Helper._schedule_columns(loan.schedule)
+        rows = np.arange(len(loan.schedule))
+        for name, symbol, value in filters or []:
+            values = columns[name][rows]
+            if digits is not None:
+                values = np.round(values, digits)
+            rows = rows[Helper.FILTER_OPERATORS[symbol](values, value)]
+        for name, ascending in reversed(sort_by or []):
+            values = columns[name][rows]
+            rows = rows[np.argsort(values if ascending else -values, kind='stable')]
+
+        page = rows[page_current * page_size:(page_current + 1) * page_size]
+        return Helper._records({name: column[page] for name, column in columns.items()}), len(rows)
+
+    @staticmethod
+    def iter_csv(schedule, chunk_size=10000, digits=2):
+        """ Generate a schedule as CSV text chunk by chunk, straight from the schedule columns.
+        :param schedule: Schedule
+        :param chunk_size: number of rows per chunk
+        :param digits: number of digits right of the decimal place of money columns
+        :return: generator of CSV text, the header first
+        """
+        yield ','.join(Schedule.COLUMNS) + '\n'
+        for start in range(0, len(schedule), chunk_size):
+            block = schedule.data[:, start:start + chunk_size]
+            columns = [Helper._format_bytes(block[0], 0, '')] + \
+                      [Helper._format_bytes(column, digits, '') for column in block[1:]]
+            # numbers are right-aligned with spaces, which CSV fields do not need
+            yield Helper._join_bytes(columns, b',', b'', b'\n').replace(b' ', b'').decode('utf-8')
+
     @staticmethod
-    def schedule_as_df(loan):
-        schedule = loan.schedule
-        df_schedule =  pd.DataFrame(columns=['Payment Number', 'Begin Principal', 'Payment', 'Extra Payment',
-                                             'Applied Principal', 'Applied Interest', 'End Principal'])
-        for i in range(len(schedule)):
-            df_schedule.loc[df_schedule.shape[0]] = list(schedule.values())[i]
-            df_schedule['Payment']
-        return df_schedule
+    def iter_parquet(schedule, chunk_size=65536):
+        """ Generate a schedule as a Parquet file chunk by chunk, one row group per chunk. Requires pyarrow.
+        :param schedule: Schedule
+        :param chunk_size: number of rows per row group
+        :return: generator of bytes
+        """
+        import pyarrow
+        import pyarrow.parquet
+
+        schema = pyarrow.schema([(Schedule.COLUMNS[0], pyarrow.int64())] +
+                                [(name, pyarrow.float64()) for name in Schedule.COLUMNS[1:]])
+        sink = _Sink()
+        with pyarrow.parquet.ParquetWriter(sink, schema) as writer:
+            for start in range(0, len(schedule), chunk_size):
+                block = schedule.data[:, start:start + chunk_size]
+                writer.write_table(pyarrow.table([block[0].astype(np.int64)] + list(block[1:]), schema=schema))
+                yield sink.drain()
+        yield sink.drain()
+
+    @staticmethod
+    def _schedule_columns(schedule, digits=None):
+        columns = {'Payment Number': schedule.payment_number.astype(np.int64)}
+        for name in Schedule.COLUMNS[1:]:
+            column = schedule.column(name)
+            columns[name] = column if digits is None else np.round(column, digits)
+        return columns
+
+    @staticmethod
+    def _format_bytes(values, digits=2, separator=',', width=0):
+        """ Format numbers as a (len(values), width) uint8 array of right-aligned text, built digit by digit with
+        array arithmetic so that no Python code runs per number.
+        """
+        values = np.ravel(np.asarray(values, dtype=np.float64))
+        if len(values) == 0:
+            return np.zeros((0, width), dtype=np.uint8)
+        finite = np.isfinite(values)
+        product = np.where(finite, np.abs(values), 0.0) * 10 ** digits
+        # numbers whose cents are beyond exact float64 integers are formatted one by one, like non-finite ones
+        exact = finite & (product < 2.0 ** 53)
+        product[~exact] = 0.0
+        scaled = np.rint(product).astype(np.int64)
+        # a product landing exactly halfway may come from a value just below or above it, round those as printf does
+        ties = np.flatnonzero(product - np.floor(product) == 0.5)
+        scaled[ties] = [int(format(value, '.{}f'.format(digits)).replace('.', '')) for value in np.abs(values[ties])]
+        whole, fraction = np.divmod(scaled, 10 ** digits)
+        negative = (values < 0) & (scaled > 0)
+        inexact = {row: (format(values[row], ',.{}f'.format(digits)).replace(',', separator) if finite[row]
+                         else str(values[row])).encode() for row in np.flatnonzero(~exact)}
+        separator = separator.encode()
+
+        # widths of each number, the text is right-aligned to the widest one
+        count = len(str(int(whole.max(initial=0))))
+        shown = [whole >= 10 ** k for k in range(count)]
+        shown[0] = np.ones(len(values), dtype=bool)
+        length = np.sum(shown, axis=0)
+        tail = digits + 1 if digits > 0 else 0
+        widths = length + (length - 1) // 3 * len(separator) + tail + negative
+        widths[~exact] = [len(number) for number in inexact.values()]
+        width = max(width, int(widths.max(initial=0)))
+
+        text = np.full((len(values), width), ord(' '), dtype=np.uint8)
+        position = width - tail
+        for k in range(count):
+            if k > 0 and k % 3 == 0:
+                for byte in reversed(separator):
+                    position -= 1
+                    text[shown[k], position] = byte
+            position -= 1
+            text[shown[k], position] = ord('0') + (whole[shown[k]] // 10 ** k) % 10
+            text[negative & (length == k + 1), position - 1] = ord('-')
+        if digits > 0:
+            text[:, width - tail] = ord('.')
+            for i in range(digits):
+                text[:, width - digits + i] = ord('0') + fraction // 10 ** (digits - 1 - i) % 10
+        for row, number in inexact.items():
+            text[row] = list(number.rjust(width))
+        return text
+
+    @staticmethod
+    def _formatted_columns(data, digits=2, separator=','):
+        return [Helper.format_column(data[0], 0, separator='')] + \
+               [Helper.format_column(column, digits, separator) for column in data[1:]]
+
+    @staticmethod
+    def _join_bytes(columns, delimiter, start, end):
+        """ Join (rows, width) uint8 arrays of text side by side into lines.
+        """
+        rows = len(columns[0])
+        constant = lambda text: np.tile(np.frombuffer(text, dtype=np.uint8), (rows, 1))
+        parts = [constant(start)]
+        for i, column in enumerate(columns):
+            parts += [column, constant(end if i == len(columns) - 1 else delimiter)]
+        return np.concatenate(parts, axis=1).tobytes()
+
+    @staticmethod
+    def _records(columns):
+        names = list(columns)
+        return [dict(zip(names, row)) for row in zip(*(column.tolist() for column in columns.values()))]
+
+
+class _Sink(io.RawIOBase):
+    """ Write-only file keeping what was written since the last drain, for streaming writers.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
 
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
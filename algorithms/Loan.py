@@ -1,8 +1,16 @@
+import numpy as np
+from algorithms.Amortization import Amortization
+from algorithms.Schedule import Schedule
+
+
 class Loan:
     """ Single Loan class
     With input principal, rate, payment, and extra payment, compute the amortization schedule, as well as
     overall metrics such as time to loan termination, total principal paid, and total interest paid.
     """
+    ITER_BLOCK = 120  # periods computed at a time when iterating over schedule rows
+    LOOP_TERM = 24  # shorter schedules are computed faster by the monthly loop than by NumPy
+
     def __init__(self, principal, rate, payment, extra_payment=0.0):
         """ Constructor to setup a single loan.
             :param principal:  principal amount left on the loan
@@ -14,7 +22,7 @@ class Loan:
         self.rate = rate
         self.payment = payment
         self.extra_payment = extra_payment
-        self.schedule = {}
+        self.schedule = Schedule()
         self.time_to_loan_termination = None
         self.total_principal_paid = 0.0
         self.total_interest_paid = 0.0
@@ -33,36 +41,128 @@ class Loan:
         if self.payment < payment_critical:
             raise ValueError(f'Payment must be greater than {payment_critical}')
 
-    def compute_schedule(self):
+    def summary(self):
+        """ Compute the time to loan termination and totals in closed form, without computing the schedule.
+            :return: time to loan termination, total interest paid
+        """
+        term, total_interest_paid, total_principal_paid = \
+            Amortization.summary(self.principal, self.rate, self.payment, self.extra_payment)
+        term = int(term)
+        self._check_term(term)
+
+        self.time_to_loan_termination = term if term > 0 else None
+        self.total_interest_paid = float(total_interest_paid)
+        self.total_principal_paid = float(total_principal_paid)
+        return self.time_to_loan_termination, self.total_interest_paid
+
+    def compute_schedule(self, engine='vectorized', materialize=True):
         """ Compute the loan schedule.
-            :return: None, the schedule is stored in an instance dictionary
+            :param engine: 'vectorized' for the closed-form NumPy engine, 'loop' for the reference monthly loop,
+            'cents' for exact integer cents with interest rounded to the cent each period, see Amortization.cents_columns
+            :param materialize: if False, only compute the time to loan termination and totals, see summary()
+            :return: None, the schedule is stored in an instance Schedule
+        """
+        if not materialize:
+            self.schedule = Schedule()
+            self.summary()
+        elif engine == 'vectorized':
+            self._compute_schedule_vectorized()
+        elif engine == 'loop':
+            self._compute_schedule_loop()
+        elif engine == 'cents':
+            self._compute_schedule_cents()
+        else:
+            raise ValueError(f'Unknown schedule engine {engine}')
+
+    def iter_schedule(self, chunk_size=None):
+        """ Generate the loan schedule lazily, without storing it. Periods are computed in closed form a block at a
+        time, so stopping early skips the rest of the schedule.
+            :param chunk_size: if None, yield row tuples as Schedule.rows() does, otherwise yield arrays of shape
+            (len(COLUMNS), chunk_size) of consecutive periods, the last one possibly shorter
+            :return: generator of rows or blocks
+        """
+        term = int(Amortization.term(self.principal, self.rate, self.payment, self.extra_payment))
+        self._check_term(term)
+
+        step = chunk_size or self.ITER_BLOCK
+        for start in range(1, term + 1, step):
+            block = np.stack(Amortization.columns(self.principal, self.rate, self.payment, self.extra_payment,
+                                                  np.arange(start, min(start + step, term + 1)), term))
+            if chunk_size:
+                yield block
+            else:
+                yield from Schedule(block).rows()
+
+    def _check_term(self, term):
+        if term < 0:
+            raise ValueError(f'Payment must be greater than {self.principal * self.rate / 12.0 / 100.0}')
+
+    def _compute_schedule_vectorized(self):
+        """ Compute the loan schedule in closed form with NumPy, or with the loop below LOOP_TERM payments.
+        """
+        term = Amortization.single_term(self.principal, self.rate, self.payment, self.extra_payment)
+        self._check_term(term)
+        if term < self.LOOP_TERM:
+            self._compute_schedule_loop()
+            return
+
+        if term > 0:
+            self.schedule = Schedule(Amortization.single_columns(self.principal, self.rate, self.payment,
+                                                                 self.extra_payment, term))
+        else:
+            self.schedule = Schedule()
+
+        self.time_to_loan_termination = term if term > 0 else None
+        self.total_interest_paid = float(self.schedule.applied_interest.sum())
+        self.total_principal_paid = float(self.schedule.applied_principal.sum())
+
+    def _compute_schedule_cents(self):
+        """ Compute the loan schedule in integer cents, totals are exact sums of cents.
+        """
+        term, columns = Amortization.cents_columns(self.principal, self.rate, self.payment, self.extra_payment)
+        term = int(term[0])
+        self._check_term(term)
+
+        columns = [column[0, :term] for column in columns]
+        self.schedule = Schedule.from_columns([columns[0]] + [column / 100.0 for column in columns[1:]])
+
+        self.time_to_loan_termination = term if term > 0 else None
+        self.total_interest_paid = int(columns[5].sum()) / 100.0
+        self.total_principal_paid = int(columns[4].sum()) / 100.0
+
+    def _compute_schedule_loop(self):
+        """ Compute the loan schedule one month at a time, this is the reference implementation.
         """
         begin_principal = self.principal
         payment = self.payment
         extra_payment = self.extra_payment
         payment_number = 0
+        schedule = {}
         
         while begin_principal > 0.0:
             payment_number += 1
             applied_interest = begin_principal * self.rate / 12.0 / 100.0
             applied_principal = payment - applied_interest + self.extra_payment
-            if applied_principal > begin_principal:
+            # the same last period test as Amortization.term, so that every engine makes as many payments
+            if begin_principal * (1.0 + self.rate / 12.0 / 100.0) <= self.payment + self.extra_payment:
                 if begin_principal + applied_interest <= payment:
                     payment = begin_principal + applied_interest
                     extra_payment = 0.0
                 else:
                     payment = payment
                     extra_payment = begin_principal + applied_interest - payment
-                applied_principal = payment - applied_interest + extra_payment
+                # the last payment clears the balance exactly, leaving no rounding residue for another period
+                applied_principal = begin_principal
             end_principal = begin_principal - applied_principal
-            self.schedule[payment_number] = (payment_number, begin_principal, payment,
-                                             extra_payment, applied_principal,
-                                             applied_interest, end_principal)
+            schedule[payment_number] = (payment_number, begin_principal, payment,
+                                        extra_payment, applied_principal,
+                                        applied_interest, end_principal)
             begin_principal = end_principal
 
+        self.schedule = Schedule.from_rows(schedule.values())
         self.time_to_loan_termination = max(self.schedule.keys()) if len(self.schedule.keys()) > 0 else None
         self.total_interest_paid = 0.0
         self.total_principal_paid = 0.0
-        for pay in self.schedule.values():
+        for pay in schedule.values():
             self.total_interest_paid += pay[5]
             self.total_principal_paid += pay[4]
@@ -0,0 +1,138 @@
+import numpy as np
+from algorithms.Amortization import Amortization
+from algorithms.Loan import Loan
+from algorithms.Schedule import Schedule
+
+
+class LoanBatch:
+    """ Batch of Loans class
+    With input arrays of principal, rate, payment, and extra payment, compute the amortization schedules of all loans
+    in one NumPy pass, as well as per-loan time to loan termination, total principal paid, and total interest paid.
+    """
+    def __init__(self, principal, rate, payment, extra_payment=0.0):
+        """ Constructor to setup a batch of loans.
+            :param principal: principal amount left on each loan
+            :param rate: annualized interest rate of each loan as a percentage
+            :param payment: minimum expected payment of each loan
+            :param extra_payment: additional payment applied to the principal of each loan
+        """
+        self.principal, self.rate, self.payment, self.extra_payment = (
+            np.array(a, dtype=np.float64) for a in
+            np.broadcast_arrays(np.ravel(principal), np.ravel(rate), np.ravel(payment), np.ravel(extra_payment)))
+        self.schedule = None  # (column, loan, payment number) array, zero padded past each loan's term
+        self.time_to_loan_termination = None
+        self.total_principal_paid = None
+        self.total_interest_paid = None
+
+    def __len__(self):
+        return len(self.principal)
+
+    def validation_errors(self):
+        """ Check the loan parameters of all loans at once, like Loan.check_loan_parameters does for one loan.
+            :return: array with the error message of each loan, empty string for valid loans
+        """
+        payment_critical = self.principal * self.rate / 12.0 / 100.0
+        checks = [
+            (self.principal <= 0.0, 'Principal must be greater than 0.0'),
+            (self.rate <= 0.0, 'Rate must be greater than 0.0'),
+            (self.payment <= 0.0, 'Payment must be greater than 0.0'),
+            (self.extra_payment < 0.0, 'Extra payment must be greater than or equal to 0.0'),
+        ]
+        errors = np.select([failed for failed, _ in checks], [message for _, message in checks], '').astype(object)
+
+        # a loan whose payments only cover the interest would never terminate
+        short = (errors == '') & ((self.payment < payment_critical) |
+                                  (self.payment + self.extra_payment <= payment_critical))
+        errors[short] = [f'Payment must be greater than {critical}' for critical in payment_critical[short]]
+        return errors
+
+    def validate(self):
+        """ Return which loans have valid parameters.
+            :return: boolean array, True for valid loans
+        """
+        return self.validation_errors() == ''
+
+    def check_loan_parameters(self):
+        """ Raise a ValueError for the first loan with invalid parameters.
+        """
+        errors = self.validation_errors()
+        invalid = np.flatnonzero(errors != '')
+        if len(invalid) > 0:
+            raise ValueError(f'Loan {invalid[0]}: {errors[invalid[0]]}')
+
+    def summary(self):
+        """ Compute the time to loan termination and totals of every loan without computing the schedules.
+            :return: time to loan termination, total interest paid, as arrays
+        """
+        term, total_interest_paid, total_principal_paid = \
+            Amortization.summary(self.principal, self.rate, self.payment, self.extra_payment)
+        self._check_term(term)
+        self.time_to_loan_termination = term
+        self.total_interest_paid = total_interest_paid
+        self.total_principal_paid = total_principal_paid
+        return self.time_to_loan_termination, self.total_interest_paid
+
+    def compute_schedule(self, engine='vectorized', materialize=True):
+        """ Compute the schedules of all loans as one array padded to the longest term.
+            :param engine: 'vectorized' for the closed-form engine, 'cents' for exact integer cents, see Loan
+            :param materialize: if False, only compute the time to loan termination and totals, see summary()
+            :return: None, the schedules are stored in an instance array
+        """
+        if not materialize:
+            self.schedule = None
+            self.summary()
+            return
+        if engine == 'cents':
+            self._compute_schedule_cents()
+            return
+        if engine != 'vectorized':
+            raise ValueError(f'Unknown schedule engine {engine}')
+
+        term = Amortization.term(self.principal, self.rate, self.payment, self.extra_payment)
+        self._check_term(term)
+        periods = np.arange(1, (term.max() if len(term) > 0 else 0) + 1)
+        self.schedule = np.stack(Amortization.columns(self.principal[:, None], self.rate[:, None],
+                                                      self.payment[:, None], self.extra_payment[:, None],
+                                                      periods[None, :], term[:, None]))
+
+        self.time_to_loan_termination = term
+        self.total_interest_paid = self.schedule[5].sum(axis=1)
+        self.total_principal_paid = self.schedule[4].sum(axis=1)
+
+    def _compute_schedule_cents(self):
+        term, columns = Amortization.cents_columns(self.principal, self.rate, self.payment, self.extra_payment)
+        self._check_term(term)
+        self.schedule = np.stack([columns[0]] + [column / 100.0 for column in columns[1:]]).astype(np.float64)
+
+        self.time_to_loan_termination = term
+        self.total_interest_paid = columns[5].sum(axis=1) / 100.0
+        self.total_principal_paid = columns[4].sum(axis=1) / 100.0
+
+    def loan_schedule(self, index):
+        """ Return the schedule of a single loan.
+            :param index: position of the loan in the batch
+            :return: Schedule of the loan
+        """
+        if self.schedule is None:
+            raise ValueError('Schedules are not computed, call compute_schedule() first')
+        return Schedule(self.schedule[:, index, :self.time_to_loan_termination[index]])
+
+    def get_loan(self, index):
+        """ Return a single loan of the batch, with its schedule and totals filled in.
+            :param index: position of the loan in the batch
+            :return: Loan
+        """
+        loan = Loan(principal=float(self.principal[index]), rate=float(self.rate[index]),
+                    payment=float(self.payment[index]), extra_payment=float(self.extra_payment[index]))
+        loan.schedule = self.loan_schedule(index)
+        term = int(self.time_to_loan_termination[index])
+        loan.time_to_loan_termination = term if term > 0 else None
+        loan.total_interest_paid = float(self.total_interest_paid[index])
+        loan.total_principal_paid = float(self.total_principal_paid[index])
+        return loan
+
+    def _check_term(self, term):
+        never = np.flatnonzero(term < 0)
+        if len(never) > 0:
+            i = never[0]
+            raise ValueError(f'Loan {i}: Payment must be greater than {self.principal[i] * self.rate[i] / 12.0 / 100.0}')
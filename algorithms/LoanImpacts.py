@@ -1,144 +1,218 @@
-from algorithms.Loan import Loan
-from algorithms.LoanPortfolio import LoanPortfolio
-import pandas as pd
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import combinations
+from math import factorial
+from statistics import NormalDist
+from algorithms.LoanBatch import LoanBatch
+import numpy as np
+
+
+def _evaluate_chunk(principal, rate, payment, extra_payment, contributions, masks, cache=None):
+    """ Compute the portfolio totals of the contributor subsets given as rows of a 0/1 matrix. This is a module level
+    function so that process pools can pickle it.
+        :param contributions: matrix of the contribution of each contributor (column) to each loan (row)
+        :param masks: matrix with one row per subset, 1 for the contributors in the subset
+        :param cache: optional ScheduleCache, only usable within one process
+        :return: total interest paid, time to loan termination, as arrays with one entry per subset
+    """
+    total_interest_paid = np.zeros(len(masks))
+    time_to_loan_termination = np.zeros(len(masks), dtype=np.int64)
+    for i in range(len(principal)):
+        scenario_extra_payment = extra_payment[i] + masks @ contributions[i]
+        if cache is not None:
+            term, interest = cache.summaries(principal[i], rate[i], payment[i], scenario_extra_payment)
+        else:
+            loans = LoanBatch(principal=principal[i], rate=rate[i], payment=payment[i],
+                              extra_payment=scenario_extra_payment)
+            loans.check_loan_parameters()
+            term, interest = loans.summary()
+        total_interest_paid += interest
+        time_to_loan_termination = np.maximum(time_to_loan_termination, term)
+    return total_interest_paid, time_to_loan_termination
+
 
 class LoanImpacts:
     """ Contributor Impacts to Loan class
     """
+    EXACT_SHAPLEY_LIMIT = 12  # contributors up to which Shapley values are computed over all subsets
+    EXECUTORS = ('serial', 'thread', 'process')
+    IMPACT_COLUMNS = ['Index', 'InterestPaid', 'Duration', 'MIInterest%', 'MIDuration%', 'MIInterest', 'MIDuration']
 
-    def __init__(self, principal, rate, payment, extra_payment, contributions): 
-        # each input is a list: 
+    def __init__(self, principal, rate, payment, extra_payment, contributions, cache=None,
+                 executor='serial', max_workers=None, chunk_size=256):
+        # each input is a list, cache is an optional ScheduleCache shared with other callers
+        # executor is 'serial', 'thread', 'process', or a concurrent.futures.Executor that evaluates chunks of
+        # chunk_size scenarios, pools created here use max_workers workers:
         self.principal = principal # principal = [principal_loan1, principal_loan2]
         self.rate = rate
         self.payment = payment
         self.extra_payment = extra_payment
         self.contributions = contributions # contributions = [{'A': 20, 'B': 20, 'C': 0}, {'A': 0, 'B': 10, 'C': 30}]
-        self.df_impacts = pd.DataFrame(columns=['Index','InterestPaid','Duration','MIInterest%','MIDuration%','MIInterest','MIDuration'])
+        if not isinstance(executor, Executor) and executor not in self.EXECUTORS:
+            raise ValueError(f'Unknown executor {executor}, expected one of {", ".join(self.EXECUTORS)} or an Executor')
+        self.cache = cache
+        self.executor = executor
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.scenarios = {}  # frozenset of contributors -> (total interest paid, time to loan termination)
+        self.df_impacts = None  # DataFrame of the last compute_impacts()
+
+    def contributors(self):
+        """ Return the contributors in input order.
+            :return: list of contributor names
+        """
+        return list(self.contributions[0]) if len(self.contributions) > 0 else []
+
+    def subsets(self):
+        """ Return every contributor subset in report order: all, none, then by size. Small subsets are listed by
+        who contributes and large subsets by who is left out, so for three contributors the order is
+        A, B, C, then B and C, A and C, A and B.
+            :return: list of tuples of contributor names
+        """
+        members = self.contributors()
+        k = len(members)
+        subsets = [tuple(members), ()]
+        for size in range(1, k):
+            if size <= k / 2:
+                subsets += list(combinations(members, size))
+            else:
+                subsets += [tuple(m for m in members if m not in left_out) for left_out in combinations(members, k - size)]
+        return subsets
+
+    def compute_scenarios(self, subsets=None):
+        """ Compute the portfolio totals for contributor subsets, with one batched amortization pass per loan.
+            :param subsets: iterable of contributor collections, every subset if None
+            :return: dictionary keyed by frozenset of contributors, with total interest paid and time to loan termination
+        """
+        members = self.contributors()
+        subsets = [frozenset(subset) for subset in (self.subsets() if subsets is None else subsets)]
+        masks = np.array([[member in subset for member in members] for subset in subsets],
+                         dtype=np.float64).reshape(len(subsets), len(members))
+        total_interest_paid, time_to_loan_termination = self._evaluate(masks)
+
+        self.scenarios = {subset: (float(interest), int(term)) for subset, interest, term
+                          in zip(subsets, total_interest_paid, time_to_loan_termination)}
+        return self.scenarios
+
+    def shapley_values(self, samples=None, seed=None, confidence=0.95):
+        """ Attribute the interest and months saved by all contributions to each contributor with Shapley values.
+        Values are exact, and add up to the total savings, when there are at most EXACT_SHAPLEY_LIMIT contributors and
+        samples is None. Otherwise they are estimated from randomly sampled contributor orderings.
+            :param samples: number of sampled orderings, 1000 if None and sampling is needed
+            :param seed: seed of the random orderings
+            :param confidence: confidence level of the sampled estimates' intervals
+            :return: DataFrame with one row per contributor, with confidence intervals when sampled
+        """
+        if samples is None and len(self.contributors()) <= self.EXACT_SHAPLEY_LIMIT:
+            return self._exact_shapley_values()
+        return self._sampled_shapley_values(1000 if samples is None else samples, seed, confidence)
+
+    def _exact_shapley_values(self):
+        members = self.contributors()
+        k = len(members)
+
+        # subset number m holds contributor j when bit j of m is set
+        subsets = np.arange(2 ** k)
+        masks = (subsets[:, None] >> np.arange(k)) & 1
+        total_interest_paid, time_to_loan_termination = self._evaluate(masks.astype(np.float64))
+        size = masks.sum(axis=1)
+        weights = np.array([factorial(s) * factorial(k - s - 1) / factorial(k) for s in range(k)])
+
+        rows = []
+        for j, member in enumerate(members):
+            without = subsets[masks[:, j] == 0]
+            weight = weights[size[without]]
+            with_member = without | (1 << j)
+            rows.append([member,
+                         float(weight @ (total_interest_paid[without] - total_interest_paid[with_member])),
+                         float(weight @ (time_to_loan_termination[without] - time_to_loan_termination[with_member]))])
+        import pandas as pd
+
+        return pd.DataFrame(rows, columns=['Contributor', 'InterestSaved', 'MonthsSaved'])
+
+    def _sampled_shapley_values(self, samples, seed, confidence):
+        members = self.contributors()
+        k = len(members)
+        rng = np.random.default_rng(seed)
+
+        # every ordering adds the contributors one at a time, prefix t holds those ranked below t
+        orderings = np.argsort(rng.random((samples, k)), axis=1)
+        rank = np.argsort(orderings, axis=1)
+        masks = rank[:, None, :] < np.arange(k + 1)[None, :, None]
+        total_interest_paid, time_to_loan_termination = self._evaluate(masks.reshape(-1, k).astype(np.float64))
+
+        rows = np.arange(samples)[:, None]
+        z = NormalDist().inv_cdf((1.0 + confidence) / 2.0)
+        result = {'Contributor': members}
+        for name, value in (('InterestSaved', total_interest_paid), ('MonthsSaved', time_to_loan_termination)):
+            value = value.reshape(samples, k + 1).astype(np.float64)
+            marginal = np.empty((samples, k))
+            marginal[rows, orderings] = value[:, :-1] - value[:, 1:]
+            mean = marginal.mean(axis=0)
+            half_width = z * marginal.std(axis=0, ddof=1) / np.sqrt(samples) if samples > 1 else np.full(k, np.nan)
+            result[name] = mean
+            result[name + 'Low'] = mean - half_width
+            result[name + 'High'] = mean + half_width
+        import pandas as pd
+
+        return pd.DataFrame(result)
+
+    def _evaluate(self, masks):
+        """ Compute the portfolio totals of the contributor subsets given as rows of a 0/1 matrix, chunk by chunk on
+        the configured executor. Results come back in the order of the rows whatever the executor.
+        """
+        members = self.contributors()
+        contributions = np.array([[contribution[member] for member in members] for contribution in self.contributions],
+                                 dtype=np.float64).reshape(len(self.principal), len(members))
+        chunks = [masks[start:start + self.chunk_size] for start in range(0, len(masks), self.chunk_size)] or [masks]
+        evaluate = partial(_evaluate_chunk, list(self.principal), list(self.rate), list(self.payment),
+                           list(self.extra_payment), contributions)
+
+        if isinstance(self.executor, Executor):
+            results = list(self.executor.map(evaluate, chunks))
+        elif self.executor == 'serial' or len(chunks) == 1:
+            results = [evaluate(chunk, cache=self.cache) for chunk in chunks]
+        elif self.executor == 'thread':
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(partial(evaluate, cache=self.cache), chunks))
+        elif self.executor == 'process':
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(evaluate, chunks))
+        else:
+            raise ValueError(f'Unknown executor {self.executor}')
+
+        total_interest_paid = np.concatenate([interest for interest, _ in results])
+        time_to_loan_termination = np.concatenate([term for _, term in results])
+        return total_interest_paid, time_to_loan_termination
+
     def compute_impacts(self):
-        # setup a loan portfolio
-        loan_portfolio_all = LoanPortfolio()
-        loan_portfolio_none = LoanPortfolio()
-       
-        # loan with all contributions (mi)_all
-        #
-        for i in range(len(self.principal)):
-            loan_all = Loan(principal=self.principal[i], rate=self.rate[i],
-                            payment=self.payment[i], extra_payment=self.extra_payment[i] + sum(self.contributions[i].values()))
-            loan_all.check_loan_parameters()   
-            loan_all.compute_schedule()
-            loan_portfolio_all.add_loan(loan_all)
-        loan_portfolio_all.aggregate()
-        
-        # loan with no contributions (mi)_0
-        #
-        for i in range(len(self.principal)):
-            loan_none = Loan(principal=self.principal[i], rate=self.rate[i],
-                             payment=self.payment[i], extra_payment=self.extra_payment[i])
-            loan_none.check_loan_parameters()
-            loan_none.compute_schedule()
-            loan_portfolio_none.add_loan(loan_none)
-        loan_portfolio_none.aggregate()
-
-        
-        micro_impact_interest_paid_all_pct = \
-            (loan_portfolio_none.total_interest_paid - loan_portfolio_all.total_interest_paid) / loan_portfolio_all.total_interest_paid
-        micro_impact_duration_all_pct = \
-            (loan_portfolio_none.time_to_loan_termination - loan_portfolio_all.time_to_loan_termination) / loan_portfolio_all.time_to_loan_termination
-
-        micro_impact_interest_paid_all = loan_portfolio_none.total_interest_paid - loan_portfolio_all.total_interest_paid
-        micro_impact_duration_all = loan_portfolio_none.time_to_loan_termination - loan_portfolio_all.time_to_loan_termination
-
-
-        # micro_impact_interest_paid_all_pct = loan_portfolio_none.total_interest_paid / loan_portfolio_all.total_interest_paid
-        # micro_impact_duration_all_pct = loan_portfolio_none.time_to_loan_termination / loan_portfolio_all.time_to_loan_termination
-
-        self.df_impacts.loc[self.df_impacts.shape[0]] = ['ALL', 
-                                                         round(loan_portfolio_all.total_interest_paid, 2), 
-                                                         loan_portfolio_all.time_to_loan_termination,
-                                                         None,
-                                                         None,
-                                                         None,
-                                                         None
-                                                         ]
-        self.df_impacts.loc[self.df_impacts.shape[0]] = ['None',
-                                                         round(loan_portfolio_none.total_interest_paid, 2),
-                                                         loan_portfolio_none.time_to_loan_termination,
-                                                         round(micro_impact_interest_paid_all_pct, 4),
-                                                         round(micro_impact_duration_all_pct, 4),
-                                                         round(micro_impact_interest_paid_all, 2),
-                                                         round(micro_impact_duration_all, 2),
-                                                         ]
-
-        if len(self.contributions[0]) > 1:
-            # loan with each contribution (mi)_index
-            #
-            for j in range(len(self.contributions[0])):
-                loan_portfolio_w_index = LoanPortfolio()
-    
-                for i in range(len(self.contributions)):
-                    loan_index = Loan(principal=self.principal[i], rate=self.rate[i], payment=self.payment[i],
-                                      extra_payment=self.extra_payment[i] + list(self.contributions[i].values())[j])
-                    loan_index.check_loan_parameters()
-                    loan_index.compute_schedule()
-                    loan_portfolio_w_index.add_loan(loan_index)
-                loan_portfolio_w_index.aggregate() 
-        
-                micro_impact_interest_paid_pct = \
-                    (loan_portfolio_w_index.total_interest_paid - loan_portfolio_all.total_interest_paid) / loan_portfolio_all.total_interest_paid
-                micro_impact_duration_pct = \
-                    (loan_portfolio_w_index.time_to_loan_termination - loan_portfolio_all.time_to_loan_termination) / loan_portfolio_all.time_to_loan_termination
-    
-                micro_impact_interest_paid = loan_portfolio_w_index.total_interest_paid - loan_portfolio_all.total_interest_paid
-                micro_impact_duration = loan_portfolio_w_index.time_to_loan_termination - loan_portfolio_all.time_to_loan_termination
-    
-                # micro_impact_interest_paid_pct = loan_portfolio_w_index.total_interest_paid / loan_portfolio_all.total_interest_paid
-                # micro_impact_duration_pct = loan_portfolio_w_index.time_to_loan_termination / loan_portfolio_all.time_to_loan_termination
-    
-                self.df_impacts.loc[self.df_impacts.shape[0]] = [list(self.contributions[i])[j],
-                                                                 round(loan_portfolio_w_index.total_interest_paid, 2),
-                                                                 loan_portfolio_w_index.time_to_loan_termination,
-                                                                 round(micro_impact_interest_paid_pct, 4),
-                                                                 round(micro_impact_duration_pct, 4),
-                                                                 round(micro_impact_interest_paid, 2),
-                                                                 round(micro_impact_duration, 2)
-                                                                 ]
-    
-
-        if len(self.contributions[0]) == 3:
-            # loan without each contribution (mi)_index
-            #
-            for j in range(len(self.contributions[0])):
-                loan_portfolio_wo_index = LoanPortfolio()
-               
-                for i in range(len(self.contributions)):
-                    loan_index = Loan(principal=self.principal[i], rate=self.rate[i], payment=self.payment[i],
-                                      extra_payment=self.extra_payment[i] + sum(self.contributions[i].values()) - list(self.contributions[i].values())[j])
-                    loan_index.check_loan_parameters()
-                    loan_index.compute_schedule()
-                    loan_portfolio_wo_index.add_loan(loan_index)
-                loan_portfolio_wo_index.aggregate() 
-        
-                micro_impact_interest_paid_pct = \
-                    (loan_portfolio_wo_index.total_interest_paid - loan_portfolio_all.total_interest_paid) / loan_portfolio_all.total_interest_paid
-                micro_impact_duration_pct = \
-                    (loan_portfolio_wo_index.time_to_loan_termination - loan_portfolio_all.time_to_loan_termination) / loan_portfolio_all.time_to_loan_termination
-
-                micro_impact_interest_paid = loan_portfolio_wo_index.total_interest_paid - loan_portfolio_all.total_interest_paid
-                micro_impact_duration = loan_portfolio_wo_index.time_to_loan_termination - loan_portfolio_all.time_to_loan_termination
-    
-                # micro_impact_interest_paid = loan_portfolio_wo_index.total_interest_paid / loan_portfolio_all.total_interest_paid
-                # micro_impact_duration = loan_portfolio_wo_index.time_to_loan_termination / loan_portfolio_all.time_to_loan_termination
-                index_member = list(self.contributions[i])
-                index_member.pop(j)
-                self.df_impacts.loc[self.df_impacts.shape[0]] = [' and '.join(index_member),
-                                                                 round(loan_portfolio_wo_index.total_interest_paid, 2),
-                                                                 loan_portfolio_wo_index.time_to_loan_termination,
-                                                                 round(micro_impact_interest_paid_pct, 4),
-                                                                 round(micro_impact_duration_pct, 4),
-                                                                 round(micro_impact_interest_paid, 2),
-                                                                 round(micro_impact_duration, 2)
-                                                                 ]
-
-#        self.df_impacts = self.df_impacts.reset_index().drop(labels='index',axis=1)
-#        print(self.df_impacts)
-        return self.df_impacts
\ No newline at end of file
+        """ Compute the impact of every contributor subset against the portfolio with all contributions.
+            :return: DataFrame with one row per subset
+        """
+        members = self.contributors()
+        subsets = self.subsets()
+        scenarios = self.compute_scenarios(subsets)
+        interest_all, duration_all = scenarios[frozenset(members)]
+
+        rows = []
+        for index, subset in enumerate(subsets):
+            interest, duration = scenarios[frozenset(subset)]
+            if index == 0:
+                rows.append(['ALL', round(interest, 2), duration, None, None, None, None])
+                continue
+            micro_impact_interest_paid = interest - interest_all
+            micro_impact_duration = duration - duration_all
+            rows.append([' and '.join(subset) if len(subset) > 0 else 'None',
+                         round(interest, 2),
+                         duration,
+                         round(micro_impact_interest_paid / interest_all, 4),
+                         round(micro_impact_duration / duration_all, 4),
+                         round(micro_impact_interest_paid, 2),
+                         round(micro_impact_duration, 2)
+                         ])
+
+        import pandas as pd
+
+        self.df_impacts = pd.DataFrame(rows, columns=self.IMPACT_COLUMNS, dtype=object) \
+            .astype({'InterestPaid': float, 'Duration': int})
+        return self.df_impacts
@@ -1,26 +1,54 @@
+from collections import Counter
+import numpy as np
+from algorithms.Schedule import Schedule
+
+
 class LoanPortfolio:
     """ Portfolio of Loans class
+    The aggregated schedule and totals are kept up to date as loans are added, removed, or replaced, at the cost of
+    the changed loan's term rather than the whole portfolio.
     """
 
     def __init__(self):
         """ Constructor to setup a portfolio of loans.
         """
         self.loans = []
-        self.schedule = {}
         self.total_principal_paid = 0.0
         self.total_interest_paid = 0.0
         self.time_to_loan_termination = None
+        self._reset()
+
+    @property
+    def schedule(self):
+        """ Aggregated schedule of all loans in the portfolio.
+        """
+        if self._schedule is None:
+            self._schedule = Schedule(self._data[:, :self._length].copy())
+        return self._schedule
 
     def add_loan(self, loan):  # loan is a Loan() instance
         """ Add a loan to the portfolio
-            :param loan: single loan
+            :param loan: single loan, its schedule or summary should be computed beforehand
         """
         self.loans.append(loan)
+        self._entries.append(self._entry(loan))
+        self._apply(self._entries[-1], 1.0)
 
     def remove_last_loan(self):
         """ Remove the last loan within the portfolio
         """
         self.loans.pop(-1)
+        self._apply(self._entries.pop(-1), -1.0)
+
+    def replace_loan(self, index, loan):
+        """ Replace a loan within the portfolio
+            :param index: position of the loan to replace
+            :param loan: single loan, its schedule or summary should be computed beforehand
+        """
+        self.loans[index] = loan
+        self._apply(self._entries[index], -1.0)
+        self._entries[index] = self._entry(loan)
+        self._apply(self._entries[index], 1.0)
 
     def get_loan_count(self):
         """ Return the number of loans in the portfolio
@@ -30,23 +58,122 @@ class LoanPortfolio:
 
     def aggregate(self):
         """ Aggregate the loans within the portfolio by creating a schedule that includes all loans.
-            :return: None, the schedule is stored in an instance dictionary
+        The schedule and totals are rebuilt from the loans on every call, so aggregating again is safe. This also picks
+        up loans whose schedule changed after they were added, and clears any rounding drift from incremental updates.
+            :return: None, the schedule is stored in an instance Schedule
+        """
+        self._reset()
+        self._entries = [self._entry(loan) for loan in self.loans]
+        if len(self._entries) == 0:
+            self._settle()
+            return
+
+        # stack every loan's periods side by side and sum them per payment number in one reduction per column
+        data = np.concatenate([schedule.data for schedule, _, _, _ in self._entries], axis=1)
+        payment_index = data[0].astype(np.int64) - 1
+        length = int(data[0].max()) if data.shape[1] > 0 else 0
+        self._data = np.stack([np.arange(1, length + 1)] + [np.bincount(payment_index, weights=column, minlength=length)
+                                                            for column in data[1:]])
+
+        for schedule, term, _, _ in self._entries:
+            self._schedule_lengths[len(schedule)] += 1
+            self._terms[term] += 1
+        self.total_principal_paid = float(np.sum([principal for _, _, principal, _ in self._entries]))
+        self.total_interest_paid = float(np.sum([interest for _, _, _, interest in self._entries]))
+        self._settle()
+
+    def iter_schedule(self, chunk_size=None):
+        """ Generate the aggregated schedule of all loans lazily, merging the loans' Loan.iter_schedule() streams
+        without computing or storing their schedules.
+            :param chunk_size: if None, yield row tuples, otherwise yield blocks of chunk_size periods
+            :return: generator of rows or blocks, see Loan.iter_schedule()
+        """
+        blocks = self.merge_schedules([loan.iter_schedule(chunk_size or loan.ITER_BLOCK) for loan in self.loans])
+        if chunk_size:
+            yield from blocks
+        else:
+            for block in blocks:
+                yield from Schedule(block).rows()
+
+    @staticmethod
+    def merge_schedules(streams):
+        """ Merge schedule streams into one aggregated stream, summing each column per payment number. Only the
+        current block of each stream is held.
+            :param streams: iterables of blocks of consecutive periods starting at payment 1, see Loan.iter_schedule()
+            :return: generator of aggregated blocks, ending with the longest stream
+        """
+        streams = [iter(stream) for stream in streams]
+        pending = [np.zeros((len(Schedule.COLUMNS), 0)) for _ in streams]
+        start = 1
+        while True:
+            # refill the streams whose block is used up, dropping the finished ones
+            for i, stream in enumerate(streams):
+                if stream is not None and pending[i].shape[1] == 0:
+                    pending[i] = next(stream, None)
+                    if pending[i] is None:
+                        streams[i], pending[i] = None, np.zeros((len(Schedule.COLUMNS), 0))
+            lengths = [block.shape[1] for stream, block in zip(streams, pending) if stream is not None]
+            if len(lengths) == 0:
+                return
+
+            # the periods that every unfinished stream has, so that the blocks stay aligned
+            length = min(lengths)
+            merged = np.zeros((len(Schedule.COLUMNS), length))
+            merged[0] = np.arange(start, start + length)
+            for i, stream in enumerate(streams):
+                if stream is not None:
+                    merged[1:] += pending[i][1:, :length]
+                    pending[i] = pending[i][:, length:]
+            start += length
+            yield merged
+
+    def _reset(self):
+        self._entries = []  # (schedule, term, total principal paid, total interest paid) of each loan when added
+        self._data = np.zeros((len(Schedule.COLUMNS), 0))  # running sums, capacity may exceed the schedule length
+        self._length = 0
+        self._schedule_lengths = Counter()
+        self._terms = Counter()
+        self._schedule = None
+
+    @staticmethod
+    def _entry(loan):
+        # loans computed with materialize=False contribute their term without a schedule
+        return loan.schedule, loan.time_to_loan_termination or 0, loan.total_principal_paid, loan.total_interest_paid
+
+    def _apply(self, entry, sign):
+        """ Add (sign 1.0) or subtract (sign -1.0) a loan's entry to the running sums.
+        """
+        schedule, term, principal, interest = entry
+        length = len(schedule)
+        if length > self._data.shape[1]:
+            capacity = max(length, 2 * self._data.shape[1])
+            data = np.zeros((len(Schedule.COLUMNS), capacity))
+            data[:, :self._data.shape[1]] = self._data
+            data[0] = np.arange(1, capacity + 1)
+            self._data = data
+        self._data[1:, :length] += sign * schedule.data[1:]
+
+        for counter, key in ((self._schedule_lengths, length), (self._terms, term)):
+            counter[key] += int(sign)
+            if counter[key] == 0:
+                del counter[key]
+        self.total_principal_paid += sign * principal
+        self.total_interest_paid += sign * interest
+        self._settle()
+
+    def _settle(self):
+        """ Derive the schedule length, time to loan termination and empty-portfolio state from the running sums.
         """
-        for loan in self.loans:
-            for key, pay in loan.schedule.items():
-                if key not in self.schedule.keys():
-                    self.schedule[key] = (key, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
-                begin_principal = self.schedule[key][1] + pay[1]
-                payment = self.schedule[key][2] + pay[2]
-                extra_payment = self.schedule[key][3] + pay[3]
-                applied_principal = self.schedule[key][4] + pay[4]
-                applied_interest = self.schedule[key][5] + pay[5]
-                end_principal = self.schedule[key][6] + pay[6]
-                self.schedule[key] = (key, begin_principal, payment, extra_payment,
-                                      applied_principal, applied_interest, end_principal)
-            self.time_to_loan_termination = len(self.schedule)
-            self.total_principal_paid += loan.total_principal_paid
-            self.total_interest_paid  += loan.total_interest_paid
+        length = max(self._schedule_lengths, default=0)
+        self._data[1:, length:self._length] = 0.0
+        self._length = length
+        self._schedule = None
+        if len(self.loans) == 0:
+            self.total_principal_paid = 0.0
+            self.total_interest_paid = 0.0
+            self.time_to_loan_termination = None
+        else:
+            self.time_to_loan_termination = max(length, max(self._terms, default=0))
 
     def compute_impact(self):  ################################### ???
         """ Compute the difference in two loans.
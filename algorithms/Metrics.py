@@ -0,0 +1,161 @@
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+import bisect
+import threading
+import time
+import numpy as np
+
+
+class Metrics:
+    """ Metrics class
+    Thread-safe registry of counters, histograms and gauges, rendered in the Prometheus text format. Histograms also
+    keep a window of recent observations, reported as p50/p90/p99 quantiles. Each process has its own registry, so
+    with several workers each one reports its own metrics.
+    """
+    SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self, window=1024):
+        """ Constructor to setup an empty registry.
+            :param window: number of recent observations per histogram series used for quantiles
+        """
+        self.window = window
+        self._families = {}  # name -> (type, help, buckets)
+        self._values = {}  # name -> {labels: counter value, or [bucket counts, sum, count, recent observations]}
+        self._gauges = {}  # name -> function returning a number or a dictionary of labels to numbers
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, help='', buckets=SECONDS_BUCKETS):
+        """ Declare a metric family.
+            :param name: metric name
+            :param kind: 'counter', 'histogram' or 'gauge'
+            :param help: help text
+            :param buckets: upper bounds of the histogram buckets
+        """
+        with self._lock:
+            self._families[name] = (kind, help, tuple(buckets))
+            self._values.setdefault(name, {})
+
+    def inc(self, name, value=1.0, **labels):
+        """ Increase a counter.
+        """
+        key = self._key(name, 'counter', labels)
+        with self._lock:
+            self._values[name][key] = self._values[name].get(key, 0.0) + value
+
+    def observe(self, name, value, **labels):
+        """ Record an observation in a histogram.
+        """
+        key = self._key(name, 'histogram', labels)
+        with self._lock:
+            buckets = self._families[name][2]
+            series = self._values[name].get(key)
+            if series is None:
+                series = self._values[name][key] = [[0] * len(buckets), 0.0, 0, deque(maxlen=self.window)]
+            index = bisect.bisect_left(buckets, value)
+            if index < len(buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+            series[3].append(value)
+
+    def gauge(self, name, function, help=''):
+        """ Declare a gauge whose value is read when rendering.
+            :param function: function without arguments, returning a number or a dictionary of label tuples to numbers
+        """
+        self.describe(name, 'gauge', help)
+        with self._lock:
+            self._gauges[name] = function
+
+    @contextmanager
+    def time(self, name, **labels):
+        """ Context manager recording the seconds spent in its block in a histogram.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name, **labels):
+        """ Decorator recording the seconds spent in each call in a histogram.
+        """
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.time(name, **labels):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def quantiles(self, name, **labels):
+        """ Return the quantiles of the recent observations of a histogram series.
+            :return: dictionary of quantile to value, empty if nothing was observed
+        """
+        with self._lock:
+            series = self._values.get(name, {}).get(tuple(sorted(labels.items())))
+            recent = list(series[3]) if series is not None else []
+        if len(recent) == 0:
+            return {}
+        return dict(zip(self.QUANTILES, np.quantile(recent, self.QUANTILES).tolist()))
+
+    def render(self):
+        """ Render every metric in the Prometheus text exposition format.
+            :return: text
+        """
+        with self._lock:
+            families = dict(self._families)
+            values = {name: {key: [list(v[0]), v[1], v[2], list(v[3])] if isinstance(v, list) else v
+                             for key, v in series.items()} for name, series in self._values.items()}
+            gauges = dict(self._gauges)
+
+        lines = []
+        for name, (kind, help, buckets) in sorted(families.items()):
+            lines += ['# HELP {} {}'.format(name, help), '# TYPE {} {}'.format(name, kind)]
+            if kind == 'gauge':
+                value = gauges[name]()
+                for key, number in (value.items() if isinstance(value, dict) else [((), value)]):
+                    lines.append('{}{} {}'.format(name, self._labels(key), self._number(number)))
+            elif kind == 'counter':
+                for key, number in sorted(values[name].items()):
+                    lines.append('{}{} {}'.format(name, self._labels(key), self._number(number)))
+            else:
+                for key, (counts, total, count, _) in sorted(values[name].items()):
+                    cumulative = np.cumsum(counts).tolist()
+                    for bound, number in zip(buckets, cumulative):
+                        lines.append('{}_bucket{} {}'.format(name, self._labels(key + (('le', self._number(bound)),)),
+                                                             number))
+                    lines.append('{}_bucket{} {}'.format(name, self._labels(key + (('le', '+Inf'),)), count))
+                    lines.append('{}_sum{} {}'.format(name, self._labels(key), self._number(total)))
+                    lines.append('{}_count{} {}'.format(name, self._labels(key), count))
+
+                # recent quantiles as a summary, e.g. p50 and p99 latency per callback
+                lines += ['# HELP {}_recent {} (last {} observations)'.format(name, help, self.window),
+                          '# TYPE {}_recent summary'.format(name)]
+                for key, (_, _, _, recent) in sorted(values[name].items()):
+                    if len(recent) == 0:
+                        continue
+                    for q, number in zip(self.QUANTILES, np.quantile(recent, self.QUANTILES).tolist()):
+                        lines.append('{}_recent{} {}'.format(name, self._labels(key + (('quantile', str(q)),)),
+                                                             self._number(number)))
+                    lines.append('{}_recent_sum{} {}'.format(name, self._labels(key), self._number(sum(recent))))
+                    lines.append('{}_recent_count{} {}'.format(name, self._labels(key), len(recent)))
+        return '\n'.join(lines) + '\n'
+
+    def _key(self, name, kind, labels):
+        if name not in self._families:
+            self.describe(name, kind)
+        return tuple(sorted(labels.items()))
+
+    @staticmethod
+    def _labels(key):
+        if len(key) == 0:
+            return ''
+        escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join('{}="{}"'.format(label, escape(value)) for label, value in key) + '}'
+
+    @staticmethod
+    def _number(value):
+        return repr(float(value)) if not float(value).is_integer() else str(int(value))
@@ -0,0 +1,99 @@
+from collections import OrderedDict
+import hashlib
+import json
+import sys
+import threading
+import time
+
+
+class ResultCache:
+    """ Result Cache class
+    Thread-safe cache of computed results keyed by a content hash of their input data. Entries expire after a time to
+    live, and the least recently used entries are evicted once the cached results exceed a memory bound.
+    """
+
+    def __init__(self, ttl=1800.0, max_bytes=256 * 2 ** 20, sizeof=sys.getsizeof):
+        """ Constructor to setup an empty cache.
+            :param ttl: seconds an entry stays valid after it is computed
+            :param max_bytes: memory bound of all cached results, as measured by sizeof
+            :param sizeof: function returning the size of a result in bytes
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()  # key -> (expiry time, size, result)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(data):
+        """ Hash JSON-serializable input data, independent of dictionary key order.
+            :param data: input data
+            :return: hexadecimal content hash
+        """
+        content = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """ Return a cached result.
+            :param key: content hash
+            :return: cached result, None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def put(self, key, result):
+        """ Cache a result, evicting expired and least recently used entries to stay within the memory bound.
+            :param key: content hash
+            :param result: computed result
+        """
+        size = self.sizeof(result)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, result)
+            self.nbytes += size
+
+            now = time.monotonic()
+            for expired in [k for k, (expiry, _, _) in self._entries.items() if expiry < now]:
+                self._remove(expired)
+                self.evictions += 1
+            while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """ Return a cached result, computing and caching it if needed.
+            :param key: content hash
+            :param compute: function without arguments computing the result
+            :return: result
+        """
+        result = self.get(key)
+        if result is None:
+            result = compute()
+            self.put(key, result)
+        return result
+
+    def stats(self):
+        """ Return the cache counters.
+            :return: dictionary of hits, misses, evictions, size, nbytes and max_bytes
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self._entries), 'nbytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.nbytes -= size
@@ -0,0 +1,113 @@
+from collections.abc import Mapping
+import numpy as np
+from algorithms.Amortization import Amortization
+
+
+class Schedule(Mapping):
+    """ Columnar amortization schedule class
+    Stores one float64 array per column in a single read-only block. The schedule still reads like the dictionary
+    of payment number to row tuple it replaces, while columns can be taken by name without unpacking rows.
+    """
+    COLUMNS = Amortization.COLUMNS
+
+    def __init__(self, data=None):
+        """ Constructor to wrap schedule columns.
+            :param data: 2-D array with one row per column in COLUMNS, empty schedule if None
+        """
+        if data is None:
+            data = np.zeros((len(self.COLUMNS), 0))
+        data = np.asarray(data, dtype=np.float64)
+        if data.ndim != 2 or data.shape[0] != len(self.COLUMNS):
+            raise ValueError(f'Schedule data must have shape ({len(self.COLUMNS)}, n), got {data.shape}')
+        self.data = data.view()
+        self.data.flags.writeable = False
+
+    @classmethod
+    def from_columns(cls, columns):
+        """ Build a schedule from a sequence of column arrays.
+            :param columns: arrays in the order of COLUMNS
+            :return: schedule
+        """
+        return cls(np.stack([np.asarray(column, dtype=np.float64) for column in columns]))
+
+    @classmethod
+    def from_rows(cls, rows):
+        """ Build a schedule from row tuples.
+            :param rows: iterable of tuples in the order of COLUMNS
+            :return: schedule
+        """
+        rows = list(rows)
+        if len(rows) == 0:
+            return cls()
+        return cls(np.array(rows, dtype=np.float64).T)
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def __iter__(self):
+        return iter(range(1, len(self) + 1))
+
+    def __getitem__(self, payment_number):
+        if isinstance(payment_number, bool) or not isinstance(payment_number, (int, np.integer)) \
+                or not 1 <= payment_number <= len(self):
+            raise KeyError(payment_number)
+        row = self.data[:, payment_number - 1].tolist()
+        row[0] = int(row[0])
+        return tuple(row)
+
+    def __repr__(self):
+        return f'Schedule(payments={len(self)})'
+
+    def rows(self):
+        """ Iterate over the schedule rows.
+            :return: generator of row tuples in the order of COLUMNS
+        """
+        payment_numbers = self.data[0].astype(np.int64).tolist()
+        return zip(payment_numbers, *(column.tolist() for column in self.data[1:]))
+
+    def column(self, name):
+        """ Return a column by name.
+            :param name: column name as in COLUMNS
+            :return: read-only float64 array
+        """
+        return self.data[self.COLUMNS.index(name)]
+
+    def to_frame(self):
+        """ Export the schedule as a DataFrame sharing memory with the schedule.
+            :return: DataFrame with one column per entry in COLUMNS
+        """
+        import pandas as pd  # loans are usable without pandas loaded
+
+        return pd.DataFrame(self.data.T, columns=self.COLUMNS, copy=False)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    @property
+    def payment_number(self):
+        return self.data[0]
+
+    @property
+    def begin_principal(self):
+        return self.data[1]
+
+    @property
+    def payment(self):
+        return self.data[2]
+
+    @property
+    def extra_payment(self):
+        return self.data[3]
+
+    @property
+    def applied_principal(self):
+        return self.data[4]
+
+    @property
+    def applied_interest(self):
+        return self.data[5]
+
+    @property
+    def end_principal(self):
+        return self.data[6]
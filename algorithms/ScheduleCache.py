@@ -0,0 +1,110 @@
+from collections import OrderedDict
+import threading
+import numpy as np
+from algorithms.Loan import Loan
+from algorithms.LoanBatch import LoanBatch
+
+
+class ScheduleCache:
+    """ Loan Schedule Cache class
+    Bounded, thread-safe LRU cache of computed loans and loan summaries, keyed on normalized loan parameters.
+    Cached loans are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, maxsize=4096):
+        """ Constructor to setup an empty cache.
+            :param maxsize: maximum number of cached loans and summaries
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(principal, rate, payment, extra_payment=0.0):
+        """ Normalize loan parameters into a cache key, so that equal loans built from different arithmetic match.
+            :return: tuple of rounded parameters
+        """
+        return tuple(round(float(value), 8) for value in (principal, rate, payment, extra_payment))
+
+    def get_loan(self, principal, rate, payment, extra_payment=0.0):
+        """ Return a loan with its schedule computed, from the cache when possible.
+            :param principal: principal amount left on the loan
+            :param rate: annualized interest rate as a percentage
+            :param payment: minimum expected payment
+            :param extra_payment: additional payment applied to the principal
+            :return: read-only Loan
+        """
+        key = ('schedule',) + self.key(principal, rate, payment, extra_payment)
+        loan = self._get(key)
+        if loan is None:
+            loan = Loan(principal=principal, rate=rate, payment=payment, extra_payment=extra_payment)
+            loan.check_loan_parameters()
+            loan.compute_schedule()
+            self._put(key, loan)
+        return loan
+
+    def summary(self, principal, rate, payment, extra_payment=0.0):
+        """ Return the time to loan termination and total interest paid of a loan, from the cache when possible.
+            :return: time to loan termination, total interest paid
+        """
+        term, total_interest_paid = self.summaries(principal, rate, payment, extra_payment)
+        return int(term[0]), float(total_interest_paid[0])
+
+    def summaries(self, principal, rate, payment, extra_payment=0.0):
+        """ Return the time to loan termination and total interest paid of many loans. Loans missing from the cache
+        are computed together in one LoanBatch pass.
+            :return: time to loan termination, total interest paid, as arrays
+        """
+        loans = LoanBatch(principal, rate, payment, extra_payment)
+        keys = [('summary',) + self.key(*parameters) for parameters in
+                zip(loans.principal, loans.rate, loans.payment, loans.extra_payment)]
+        results = [self._get(key) for key in keys]
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        if len(missing) > 0:
+            batch = LoanBatch(loans.principal[missing], loans.rate[missing], loans.payment[missing],
+                              loans.extra_payment[missing])
+            batch.check_loan_parameters()
+            term, total_interest_paid = batch.summary()
+            for j, i in enumerate(missing):
+                results[i] = (int(term[j]), float(total_interest_paid[j]))
+                self._put(keys[i], results[i])
+
+        term = np.array([result[0] for result in results], dtype=np.int64)
+        total_interest_paid = np.array([result[1] for result in results], dtype=np.float64)
+        return term, total_interest_paid
+
+    def stats(self):
+        """ Return the cache counters.
+            :return: dictionary of hits, misses, evictions, size and maxsize
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self._entries), 'maxsize': self.maxsize}
+
+    def clear(self):
+        """ Remove every entry, counters are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def _get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def _put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
@@ -0,0 +1,226 @@
+""" Batch amortization of loan files, streamed in bounded-size chunks.
+    python -m algorithms.batch loans.csv summaries.csv
+    python -m algorithms.batch loans.parquet schedules.parquet --schedules --max-rows 500000 --workers 4
+Input rows need principal, rate and payment columns, and may have an extra_payment column; other columns are copied
+to the summaries. Rows without a loan column get one with their 0-based row number in the input, to identify them in
+the summaries, schedules and rejects. Rows failing the checks of Loan.check_loan_parameters are written with an error
+column to the reject file instead of stopping the job.
+With --schedules, chunks are further split so that each one expands to at most --max-rows payment rows.
+CSV and Parquet are chosen by file extension; Parquet needs pyarrow.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import collections
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from algorithms.Amortization import Amortization
+from algorithms.LoanBatch import LoanBatch
+from algorithms.Schedule import Schedule
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet support is optional
+    pyarrow = None
+
+PARAMETERS = ['principal', 'rate', 'payment', 'extra_payment']
+
+
+def file_format(path):
+    """ Return 'parquet' for .parquet and .pq files, 'csv' otherwise.
+    """
+    return 'parquet' if os.path.splitext(path)[1].lower() in ('.parquet', '.pq') else 'csv'
+
+
+def read_chunks(path, chunk_size):
+    """ Read a loan file chunk by chunk.
+        :param path: CSV or Parquet file
+        :param chunk_size: number of rows per chunk
+        :return: iterator of DataFrames
+    """
+    if file_format(path) == 'parquet':
+        if pyarrow is None:
+            raise ImportError('Reading Parquet files requires pyarrow')
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+
+class ChunkWriter:
+    """ Chunk Writer class
+    Append DataFrames with the same columns to a CSV or Parquet file. An existing file is replaced, the new one is only
+    created by the first chunk.
+    """
+
+    def __init__(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        self.path = path
+        self.format = file_format(path)
+        self.rows = 0
+        self._writer = None
+
+    def write(self, frame):
+        if self.format == 'parquet':
+            if pyarrow is None:
+                raise ImportError('Writing Parquet files requires pyarrow')
+            if self._writer is None:
+                table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+                self._writer = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+            else:
+                table = pyarrow.Table.from_pandas(frame, schema=self._writer.schema, preserve_index=False)
+            self._writer.write_table(table)
+        else:
+            frame.to_csv(self.path, mode='w' if self.rows == 0 else 'a', header=self.rows == 0, index=False)
+        self.rows += len(frame)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def split_rows(frame, max_rows):
+    """ Split a chunk of loans into consecutive parts whose schedules have at most max_rows payment rows in total. A
+    loan with more payments than max_rows gets a part of its own.
+        :param frame: DataFrame of loan rows
+        :param max_rows: maximum number of payment rows per part
+        :return: iterator of (offset of the first row in frame, DataFrame) pairs
+    """
+    values = [pd.to_numeric(frame[name], errors='coerce').to_numpy(dtype=np.float64) if name in frame
+              else np.full(len(frame), np.nan) for name in PARAMETERS]
+    values[3] = np.nan_to_num(values[3])
+    # rejected loans count as one row, they only produce a reject
+    rows = np.maximum(Amortization.term(*values), 1) if len(frame) > 0 else np.zeros(0, dtype=np.int64)
+    total = np.cumsum(rows)
+    start = 0
+    while start < len(frame):
+        stop = max(int(np.searchsorted(total, total[start] - rows[start] + max_rows, side='right')), start + 1)
+        yield start, frame.iloc[start:stop]
+        start = stop
+
+
+def process_chunk(frame, start, schedules=False):
+    """ Validate and amortize a chunk of loans. This is a module level function so that process pools can pickle it.
+        :param frame: DataFrame of loan rows
+        :param start: row number of the first row of the chunk in the input
+        :param schedules: if True, return the exploded schedules instead of the summaries
+        :return: DataFrame of results, DataFrame of rejected rows with their error
+    """
+    missing = [name for name in PARAMETERS[:3] if name not in frame]
+    if len(missing) > 0:
+        raise ValueError('Missing loan column(s): {}'.format(', '.join(missing)))
+    frame = frame.reset_index(drop=True)
+    if 'loan' not in frame:
+        frame.insert(0, 'loan', np.arange(start, start + len(frame)))
+    if 'extra_payment' not in frame:
+        frame['extra_payment'] = 0.0
+
+    # parameters that are missing or not numbers fail before the loan checks
+    values = {name: pd.to_numeric(frame[name], errors='coerce').to_numpy(dtype=np.float64) for name in PARAMETERS}
+    values['extra_payment'] = np.where(frame['extra_payment'].isna(), 0.0, values['extra_payment'])
+    errors = np.full(len(frame), '', dtype=object)
+    for name in reversed(PARAMETERS):
+        errors[~np.isfinite(values[name])] = f'{name} must be a number'
+    numeric = errors == ''
+    loans = LoanBatch(*(values[name][numeric] for name in PARAMETERS))
+    errors[numeric] = loans.validation_errors()
+
+    valid = errors == ''
+    rejects = frame[~valid].assign(error=errors[~valid])
+    loans = LoanBatch(*(values[name][valid] for name in PARAMETERS))
+    if not schedules:
+        term, total_interest_paid = loans.summary()
+        result = frame[valid].assign(time_to_loan_termination=term, total_interest_paid=total_interest_paid,
+                                     total_principal_paid=loans.total_principal_paid)
+        return result, rejects
+
+    # one row per payment without padding loans to the longest term, so memory follows the number of payments
+    term = Amortization.term(loans.principal, loans.rate, loans.payment, loans.extra_payment)
+    index = np.repeat(np.arange(len(loans)), term)
+    periods = np.arange(len(index)) - np.repeat(np.cumsum(term) - term, term) + 1
+    columns = Amortization.columns(loans.principal[index], loans.rate[index], loans.payment[index],
+                                   loans.extra_payment[index], periods, term[index])
+    result = pd.DataFrame(dict(zip(Schedule.COLUMNS, columns)))
+    result['Payment Number'] = periods
+    result.insert(0, 'loan', frame['loan'].to_numpy()[valid][index])
+    return result, rejects
+
+
+def run(input_path, output_path, reject_path, chunk_size=100000, schedules=False, workers=1, max_rows=1000000):
+    """ Amortize every loan of a file, streaming results and rejects chunk by chunk.
+        :param input_path: CSV or Parquet file of loans
+        :param output_path: CSV or Parquet file of summaries or schedules
+        :param reject_path: CSV or Parquet file of rejected rows
+        :param chunk_size: number of loans per chunk, bounds the memory used
+        :param schedules: if True, write the exploded schedules instead of the summaries
+        :param workers: number of processes amortizing chunks, 1 to run in this process
+        :param max_rows: with schedules, maximum number of payment rows per chunk, which bounds the memory instead
+        :return: dictionary of row counts
+    """
+    def parts():
+        loans = 0
+        for chunk in read_chunks(input_path, chunk_size):
+            if schedules:
+                for offset, part in split_rows(chunk, max_rows):
+                    yield part, loans + offset
+            else:
+                yield chunk, loans
+            loans += len(chunk)
+
+    output, rejected = ChunkWriter(output_path), ChunkWriter(reject_path)
+    loans = 0
+    try:
+        if workers > 1:
+            # at most two chunks per worker are read ahead, so memory stays flat whatever the input size
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pending = collections.deque()
+                for part, start in parts():
+                    pending.append(executor.submit(process_chunk, part, start, schedules))
+                    loans += len(part)
+                    if len(pending) >= 2 * workers:
+                        _write(pending.popleft().result(), output, rejected)
+                while pending:
+                    _write(pending.popleft().result(), output, rejected)
+        else:
+            for part, start in parts():
+                _write(process_chunk(part, start, schedules), output, rejected)
+                loans += len(part)
+    finally:
+        output.close()
+        rejected.close()
+    return {'loans': loans, 'rejected': rejected.rows, 'rows': output.rows}
+
+
+def _write(results, output, rejected):
+    result, rejects = results
+    if len(result) > 0:
+        output.write(result)
+    if len(rejects) > 0:
+        rejected.write(rejects)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m algorithms.batch', description=__doc__.splitlines()[0])
+    parser.add_argument('input', help='CSV or Parquet file of loans')
+    parser.add_argument('output', help='CSV or Parquet file of results')
+    parser.add_argument('--rejects', help='file of rejected rows, by default next to the output with .rejects.csv')
+    parser.add_argument('--schedules', action='store_true', help='write exploded schedules instead of summaries')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='loans per chunk')
+    parser.add_argument('--max-rows', type=int, default=1000000, help='payment rows per chunk with --schedules')
+    parser.add_argument('--workers', type=int, default=1, help='processes amortizing chunks in parallel')
+    args = parser.parse_args(argv)
+
+    reject_path = args.rejects or os.path.splitext(args.output)[0] + '.rejects.csv'
+    start = time.perf_counter()
+    counts = run(args.input, args.output, reject_path, args.chunk_size, args.schedules, args.workers,
+                 args.max_rows)
+    print('{loans} loans, {rejected} rejected, {rows} rows written'.format(**counts),
+          'in {:.1f} s'.format(time.perf_counter() - start), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,21 +2,35 @@
 # Jiaying Yan - jiayingyan@brandeis.edu
 
 # <editor-fold desc="import modules">
-import pandas as pd
 import numpy as np
+from functools import wraps
+from itertools import combinations
+import importlib.util
+import io
 import json
-import os
+import logging
+import math
+import pickle
 import re
+import time
+import urllib.parse
 import dash
 import dash_table
+from dash_table.Format import Format, Group, Scheme
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
-from dash.dependencies import State, Input, Output
+from dash.dependencies import ClientsideFunction, State, Input, Output
 from dash.exceptions import PreventUpdate
+import flask
 import plotly.graph_objects as go
-from algorithms.Helper import *
-from algorithms.LoanImpacts import *
+from algorithms.Helper import Helper
+from algorithms.LoanImpacts import LoanImpacts
+from algorithms.LoanPortfolio import LoanPortfolio
+from algorithms.Metrics import Metrics
+from algorithms.ResultCache import ResultCache
+from algorithms.Schedule import Schedule
+from algorithms.ScheduleCache import ScheduleCache
 
 # </editor-fold>
 
@@ -24,8 +38,201 @@ from algorithms.LoanImpacts import *
 external_stylesheets = [dbc.themes.BOOTSTRAP,
                         'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/4.7.0/css/font-awesome.min.css']
 
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
-app.config.suppress_callback_exceptions = True
+# callbacks are collected here and registered on every app made by create_app(), so the module can be imported
+# without creating or serving an app
+CALLBACKS = []
+
+
+def callback(*args, **kwargs):
+    """ Decorator collecting a server callback, with the arguments of Dash.callback.
+    """
+    def collect(function):
+        CALLBACKS.append(('callback', args, kwargs, function))
+        return function
+    return collect
+
+
+def clientside_callback(clientside_function, *args, **kwargs):
+    """ Collect a clientside callback, with the arguments of Dash.clientside_callback.
+    """
+    CALLBACKS.append(('clientside_callback', args, kwargs, clientside_function))
+
+
+def register_callbacks(app):
+    """ Register the collected callbacks on an app.
+    :param app: Dash app
+    """
+    for kind, args, kwargs, function in CALLBACKS:
+        if kind == 'callback':
+            app.callback(*args, **kwargs)(instrument_callback(function))
+        else:
+            app.clientside_callback(function, *args, **kwargs)
+
+
+logger = logging.getLogger(__name__)
+
+# latency, payload and cache metrics of this process, served in the Prometheus format on /metrics
+metrics = Metrics()
+metrics.describe('dash_callback_seconds', 'histogram', 'Time spent in a server callback')
+metrics.describe('dash_callback_request_bytes', 'histogram', 'Request body size of a server callback',
+                 buckets=Metrics.BYTES_BUCKETS)
+metrics.describe('dash_callback_response_bytes', 'histogram', 'Response body size of a server callback',
+                 buckets=Metrics.BYTES_BUCKETS)
+metrics.describe('dash_callback_errors_total', 'counter', 'Server callbacks that raised an exception')
+metrics.describe('dash_callback_prevented_total', 'counter', 'Server callbacks that prevented the update')
+metrics.describe('algorithm_seconds', 'histogram', 'Time spent in a loan computation')
+
+
+def instrument_callback(function):
+    """ Wrap a server callback to record its latency and outcome, and label its request for the payload metrics.
+    :param function: callback function
+    :return: wrapped function
+    """
+    name = function.__name__
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if flask.has_request_context():
+            flask.g.callback = name
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        except PreventUpdate:
+            metrics.inc('dash_callback_prevented_total', callback=name)
+            raise
+        except Exception:
+            metrics.inc('dash_callback_errors_total', callback=name)
+            logger.exception('callback=%s failed', name)
+            raise
+        finally:
+            metrics.observe('dash_callback_seconds', time.perf_counter() - start, callback=name)
+    return wrapper
+
+
+def register_metrics(app):
+    """ Record the payload sizes of server callbacks and serve the metrics on /metrics.
+    :param app: Dash app
+    """
+    @app.server.after_request
+    def record_payload(response):
+        name = flask.g.get('callback')
+        if name is not None:
+            metrics.observe('dash_callback_request_bytes', flask.request.content_length or 0, callback=name)
+            metrics.observe('dash_callback_response_bytes', response.calculate_content_length() or 0, callback=name)
+        return response
+
+    @app.server.route('/metrics')
+    def serve_metrics():
+        return flask.Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# computed loans shared by all callbacks, so repeated interactions look schedules up instead of recomputing them
+schedule_cache = ScheduleCache(maxsize=4096)
+
+# results of applied loan data, computed once per distinct data and read by every callback
+result_cache = ResultCache(ttl=1800.0, max_bytes=256 * 2 ** 20, sizeof=lambda results: results['nbytes'])
+
+# precompute the schedule figure and impact banner of every contribution checklist subset along with the results, so
+# that checklist toggles only look them up; if False they are computed on each toggle
+PRECOMPUTE_VIEWS = True
+# subsets grow as 2 ** contributors, with more contributors than the inputs allow views are computed on each toggle
+PRECOMPUTE_VIEWS_MAX_CONTRIBUTORS = 3
+
+
+def cache_stats(stat):
+    """ Return a statistic of both caches for a gauge.
+    """
+    def read():
+        values = {}
+        for name, cache in (('schedule', schedule_cache), ('result', result_cache)):
+            stats = cache.stats()
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_ratio'] = stats['hits'] / lookups if lookups > 0 else 0.0
+            if stat in stats:
+                values[(('cache', name),)] = stats[stat]
+        return values
+    return read
+
+
+metrics.gauge('cache_hits', cache_stats('hits'), 'Cache lookups that found an entry')
+metrics.gauge('cache_misses', cache_stats('misses'), 'Cache lookups that found no entry')
+metrics.gauge('cache_evictions', cache_stats('evictions'), 'Cache entries evicted')
+metrics.gauge('cache_hit_ratio', cache_stats('hit_ratio'), 'Share of cache lookups that found an entry')
+metrics.gauge('cache_entries', cache_stats('size'), 'Entries in the cache')
+metrics.gauge('cache_bytes', cache_stats('nbytes'), 'Memory used by the cached results')
+
+
+@metrics.timed('algorithm_seconds', function='compute_results')
+def compute_results(loans_data):
+    """ Compute the schedules, portfolio aggregate and contribution impacts of the applied loan data.
+    :param loans_data: data of apply-store
+    :return: dictionary of results
+    """
+    principal = [i['principal'] for i in loans_data]
+    rate = [i['rate'] for i in loans_data]
+    payment = [i['payment'] for i in loans_data]
+    extra_payment = [i['extra'] for i in loans_data]
+    if_contribution = any([sum(i.values()) for i in [loan['contribution'] for loan in loans_data]])
+    contribution = [i['contribution'] for i in loans_data] if if_contribution else None
+
+    # schedules with all the contributions
+    schedules = {}
+    portfolio = LoanPortfolio()
+    for index, loan_data in enumerate(loans_data):
+        loan = schedule_cache.get_loan(principal=loan_data['principal'], rate=loan_data['rate'],
+                                       payment=loan_data['payment'],
+                                       extra_payment=loan_data['extra'] + sum(loan_data['contribution'].values()))
+        portfolio.add_loan(loan)
+        schedules['loan{}'.format(index + 1)] = loan
+    portfolio.aggregate()
+    schedules['portfolio'] = portfolio
+
+    if contribution != None:
+        with metrics.time('algorithm_seconds', function='LoanImpacts.compute_impacts'):
+            df_impact = LoanImpacts(principal=principal, rate=rate, payment=payment, extra_payment=extra_payment,
+                                    contributions=contribution, cache=schedule_cache).compute_impacts()
+    else:
+        df_impact = None
+
+    results = {'key': ResultCache.key_for(loans_data), 'principal': principal, 'rate': rate, 'payment': payment, 'extra_payment': extra_payment,
+               'contribution': contribution, 'schedules': schedules, 'df_impact': df_impact, 'views': {}}
+
+    # one view per checklist value, the same subsets as the impact scenarios
+    members = list(contribution[0].keys()) if contribution != None else []
+    if PRECOMPUTE_VIEWS and len(members) <= PRECOMPUTE_VIEWS_MAX_CONTRIBUTORS:
+        for size in range(len(members) + 1):
+            for checklist_value in combinations(members, size):
+                results['views'][frozenset(checklist_value)] = compute_view(results, list(checklist_value))
+
+    # loans are held by schedule_cache, only the portfolio, the figures and the table belong to these results
+    nbytes = portfolio.schedule.nbytes
+    nbytes += sum(len(pickle.dumps(view['figure'], pickle.HIGHEST_PROTOCOL)) + len(view['banner'] or '')
+                  for view in results['views'].values())
+    if df_impact is not None:
+        nbytes += int(df_impact.memory_usage(deep=True).sum())
+    results['nbytes'] = nbytes
+    return results
+
+
+def get_results(loans_data):
+    """ Return the results of the applied loan data from the result cache, computing them on a miss.
+    :param loans_data: data of apply-store
+    :return: content hash of the loan data, dictionary of results
+    """
+    key = ResultCache.key_for(loans_data)
+    return key, result_cache.get_or_compute(key, lambda: compute_results(loans_data))
+
+
+def get_view(results, checklist_value):
+    """ Return the schedule figure and impact banner of the checked contributors, precomputed when possible.
+    :param results: results of the applied loan data
+    :param checklist_value: value of contribution_checklist
+    :return: dictionary of the loans, figure and banner
+    """
+    view = results['views'].get(frozenset(checklist_value or []))
+    if view is None:
+        view = compute_view(results, checklist_value)
+    return view
 
 
 # <editor-fold desc="app-components">
@@ -180,7 +387,8 @@ loan_input_card = dbc.Card(
 # <editor-fold desc="app-callbacks">
 
 # %% alter input panel
-@app.callback(
+clientside_callback(
+    ClientsideFunction(namespace='ui', function_name='loan_num'),
     [
         Output('loan-number', 'data'),
         Output({'type': 'individual-loan-input', 'index': '2'}, 'style'),
@@ -194,6 +402,20 @@ loan_input_card = dbc.Card(
         Output({'type': 'individual-contribution', 'index': '1-C'}, 'style'),
         Output({'type': 'individual-contribution', 'index': '2-C'}, 'style'),
         Output({'type': 'individual-contribution', 'index': '3-C'}, 'style'),
+    ],
+    [
+        Input("contribution-button", 'n_clicks'),
+        Input("decrease-loan", 'n_clicks'),
+        Input("increase-loan", 'n_clicks'),
+        Input('reset-button', 'n_clicks')
+    ],
+    [State('loan-number', 'data')]
+)
+
+# clear the loan inputs on reset
+clientside_callback(
+    ClientsideFunction(namespace='ui', function_name='reset_inputs'),
+    [
         Output({'type': 'principal', 'index': '1'}, 'value'),
         Output({'type': 'principal', 'index': '2'}, 'value'),
         Output({'type': 'principal', 'index': '3'}, 'value'),
@@ -216,93 +438,59 @@ loan_input_card = dbc.Card(
         Output({'type': 'contribution', 'index': '3-B'}, 'value'),
         Output({'type': 'contribution', 'index': '3-C'}, 'value'),
     ],
-    [
-        Input("contribution-button", 'n_clicks'),
-        Input("decrease-loan", 'n_clicks'),
-        Input("increase-loan", 'n_clicks'),
-        Input('reset-button', 'n_clicks')
-    ],
-    [State('loan-number', 'data'),
-     State({'type': 'principal', 'index': '1'}, 'value'),
-     State({'type': 'principal', 'index': '2'}, 'value'),
-     State({'type': 'principal', 'index': '3'}, 'value'),
-     State({'type': 'rate', 'index': '1'}, 'value'),
-     State({'type': 'rate', 'index': '2'}, 'value'),
-     State({'type': 'rate', 'index': '3'}, 'value'),
-     State({'type': 'payment', 'index': '1'}, 'value'),
-     State({'type': 'payment', 'index': '2'}, 'value'),
-     State({'type': 'payment', 'index': '3'}, 'value'),
-     State({'type': 'extra', 'index': '1'}, 'value'),
-     State({'type': 'extra', 'index': '2'}, 'value'),
-     State({'type': 'extra', 'index': '3'}, 'value'),
-     State({'type': 'contribution', 'index': '1-A'}, 'value'),
-     State({'type': 'contribution', 'index': '1-B'}, 'value'),
-     State({'type': 'contribution', 'index': '1-C'}, 'value'),
-     State({'type': 'contribution', 'index': '2-A'}, 'value'),
-     State({'type': 'contribution', 'index': '2-B'}, 'value'),
-     State({'type': 'contribution', 'index': '2-C'}, 'value'),
-     State({'type': 'contribution', 'index': '3-A'}, 'value'),
-     State({'type': 'contribution', 'index': '3-B'}, 'value'),
-     State({'type': 'contribution', 'index': '3-C'}, 'value')]
-)
-def loan_num(n, back, nxt, reset_n, last_history, principal1, principal2, principal3, rate1, rate2, rate3, payment1,
-             payment2, payment3,
-             extra1, extra2, extra3, contribution1a, contribution1b, contribution1c, contribution2a, contribution2b,
-             contribution2c, contribution3a,
-             contribution3b, contribution3c):
-    vis = {'display': 'block'}
-    invis = {'display': 'none'}
-    button_id = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
-    reset_n = 0
-    if button_id == "reset-button":
-        last_history["num"] = 1
-        return (last_history,) + tuple({"display": "none"} for i in range(11)) + tuple(None for i in range(21))
-    else:
-        try:
-            if back > last_history["back"]:
-                last_history["back"] = back
-                last_history['num'] = max(1, last_history['num'] - 1)
-            elif nxt > last_history["next"]:
-                last_history["next"] = nxt
-                last_history['num'] = min(3, last_history['num'] + 1)
-            loan_2 = invis
-            loan_3 = invis
-            contribute_1 = invis
-            contribute_2 = invis
-            contribute_3 = invis
-            contribute_b = invis
-            contribute_c = invis
-            if n >= 2:
-                contribute_b = vis
-            if n >= 3:
-                contribute_c = vis
-            if n:
-                contribute_1 = vis
-            if last_history['num'] >= 2:
-                loan_2 = vis
-                if n:
-                    contribute_2 = vis
-            if last_history['num'] == 3:
-                loan_3 = vis
-                if n:
-                    contribute_3 = vis
-            return last_history, loan_2, loan_3, contribute_1, contribute_2, contribute_3, contribute_b, contribute_b, \
-                   contribute_b, contribute_c, contribute_c, contribute_c, principal1, principal2, principal3, rate1, rate2, rate3, \
-                   payment1, payment2, payment3, extra1, extra2, extra3, contribution1a, contribution1b, contribution1c, \
-                   contribution2a, contribution2b, contribution2c, contribution3a, contribution3b, contribution3c
-        # if last_history store is None
-        except:
-            last_history = {"num": 1, "back": 0, "next": 0}
-            return (last_history,) + tuple(invis for _ in range(11)) + (
-                principal1, principal2, principal3, rate1, rate2, rate3, payment1, payment2, payment3, extra1, extra2,
-                extra3, contribution1a, contribution1b, contribution1c, contribution2a, contribution2b, contribution2c,
-                contribution3a, contribution3b, contribution3c)
+    [Input('reset-button', 'n_clicks')],
+    prevent_initial_call=True)
 
 
 # %%
 
 # %% store input loan data
-@app.callback(
+LOAN_VALUE = re.compile(r'^[1-9]+\d*(\.\d{1,2})?$')
+
+
+def loan_value(value, allow_zero=False):
+    """ Return an input value as a float if it is a valid amount or rate: positive, at most 1e15, at most 2 decimals.
+    :param value: input value
+    :param allow_zero: if True, 0 is valid too, as for extra payments and contributions
+    :return: float, None if not valid
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if (allow_zero and value == 0.0) or (0.0 < value <= 1e15 and LOAN_VALUE.match(str(value))):
+        return value
+    return None
+
+
+def valid_loans_data(loans_data):
+    """ Check loan data as on_click builds it: 1 to 3 loans of valid numbers, the same contributors among A, B and C
+    on every loan, and payments greater than the first month's interest.
+    :param loans_data: data of apply-store, or data of unknown origin
+    :return: True if valid
+    """
+    if not isinstance(loans_data, list) or not 1 <= len(loans_data) <= 3:
+        return False
+    members = None
+    for loan in loans_data:
+        if not isinstance(loan, dict) or set(loan) != {'principal', 'rate', 'payment', 'extra', 'contribution'}:
+            return False
+        contribution = loan['contribution']
+        if not isinstance(contribution, dict) or not set(contribution) <= {'A', 'B', 'C'} or \
+                (members is not None and set(contribution) != members):
+            return False
+        members = set(contribution)
+        values = [loan['principal'], loan['rate'], loan['payment'], loan['extra']] + list(contribution.values())
+        if any(type(value) not in (int, float) for value in values) or \
+                any(loan_value(value) is None for value in values[:3]) or \
+                any(loan_value(value, allow_zero=True) is None for value in values[3:]):
+            return False
+        if loan['payment'] <= loan['principal'] * loan['rate'] / 1200.0:
+            return False
+    return True
+
+
+@callback(
     [
         Output('apply-alert', 'children'),
         Output('apply-alert', 'is_open'),
@@ -384,28 +572,18 @@ def on_click(n_clicks, loan_number, principal1, principal2, principal3, rate1, r
     else:
         # input value if valid else none
         def num(value):
-            try:
-                value = float(value)
-                if 0.0 < value <= 1e15 and re.compile(r'^[1-9]+\d*(\.\d{1,2})?$').match(str(value)):
-                    return value
-                else:
-                    return None
-            except:
-                return None
+            return loan_value(value)
 
         invalid_flag = [1]
 
         def extra(value):
             try:
                 value = float(value)
-                if 0.0 <= value <= 1e15 and (value == 0.0 or re.compile(r'^[1-9]+\d*(\.\d{1,2})?$').match(str(value))):
-                    return value
-                else:
-                    # print(value)
-                    invalid_flag[0] = -1
-                    return None
             except:
                 return None
+            if loan_value(value, allow_zero=True) is None:
+                invalid_flag[0] = -1
+            return loan_value(value, allow_zero=True)
 
         # initialize loan data
         loan1, loan2, loan3 = (
@@ -481,8 +659,9 @@ def on_click(n_clicks, loan_number, principal1, principal2, principal3, rate1, r
                     alert_class = 'd-flex apply-alert alert-success'
                     alert_message = 'See your loan schedules below'
 
-        print('loan number is:', loan_num)
-        print('stored loan data:', data)
+        logger.info('apply loan_number=%d valid=%s key=%s', loan_num, len(data) > 0,
+                    ResultCache.key_for(data) if data else '')
+        logger.debug('apply data=%s', data)
         return (alert_message, True, alert_class, anchor_style, row_display, row_display, data,) + tuple(flags) + (
             inval1, inval2, inval3, inval4, inval5, inval6, inval7, inval8, inval9,
             inval10, inval11, inval12)
@@ -491,24 +670,22 @@ def on_click(n_clicks, loan_number, principal1, principal2, principal3, rate1, r
 # %%
 
 # %% Reset input
-@app.callback(
+clientside_callback(
+    ClientsideFunction(namespace='ui', function_name='reset'),
     [Output("contribution-button", 'n_clicks'),
      Output('apply-button', 'n_clicks')],
     [Input('reset-button', 'n_clicks')],
     prevent_initial_call=True)
-def reset(n):
-    if n:
-        return 0, 0
 
 
 # %%
 
 # %% Show checklist
-@app.callback([Output('contribution_checklist', 'options'),
-               Output('contribution_checklist', 'value')],
-              [Input('apply-store', 'modified_timestamp')],
-              [State('apply-store', 'data')],
-              prevent_initial_call=True)
+@callback([Output('contribution_checklist', 'options'),
+           Output('contribution_checklist', 'value')],
+          [Input('apply-store', 'modified_timestamp')],
+          [State('apply-store', 'data')],
+          prevent_initial_call=True)
 def update_checklist(modified_timestamp, loans_data):
     # print(modified_timestamp)
     # print(loans_data)
@@ -529,70 +706,171 @@ def update_checklist(modified_timestamp, loans_data):
 
 # %% Show schedule figure
 # Define functions for use of shedule figure
-def get_Bar_principal(index, df_schedule):
-    palette = [dict(color='rgba(163, 201, 199, 1)', line=dict(color='rgba(163, 201, 199, 1)')),
-               dict(color='rgba(163, 201, 199, 0.7)', line=dict(color='rgba(163, 201, 199, 0.7)')),
-               dict(color='rgba(163, 201, 199, 0.4)', line=dict(color='rgba(163, 201, 199, 0.4)')),
-               ]
+PRINCIPAL_PALETTE = [dict(color='rgba(163, 201, 199, 1)', line=dict(color='rgba(163, 201, 199, 1)')),
+                     dict(color='rgba(163, 201, 199, 0.7)', line=dict(color='rgba(163, 201, 199, 0.7)')),
+                     dict(color='rgba(163, 201, 199, 0.4)', line=dict(color='rgba(163, 201, 199, 0.4)')),
+                     ]
+INTEREST_PALETTE = [dict(color='rgba(236, 197, 76, 1)', line=dict(color='rgba(236, 197, 76, 1)')),
+                    dict(color='rgba(236, 197, 76, 0.7)', line=dict(color='rgba(236, 197, 76, 0.7)')),
+                    dict(color='rgba(236, 197, 76, 0.4)', line=dict(color='rgba(236, 197, 76, 0.4)')),
+                    ]
+
+# Level of detail: months per bucket, tried in order (monthly, quarterly, yearly), the most buckets per trace, and
+# the figure point count above which bars give way to WebGL step areas
+SCHEDULE_BUCKETS = [1, 3, 12]
+SCHEDULE_MAX_BUCKETS = 360
+SCHEDULE_WEBGL_POINTS = 1000
+
+
+def get_Bar_principal(index, df_schedule, width=None):
     fig = go.Bar(name='Loan{} Principal'.format(index + 1),
                  x=df_schedule['Payment Number'],
                  y=df_schedule['Applied Principal'],
-                 marker=palette[index],
+                 width=width,
+                 marker=PRINCIPAL_PALETTE[index],
                  legendgroup=index,
                  )
     return fig
 
 
-def get_Bar_interest(index, df_schedule):
-    palette = [dict(color='rgba(236, 197, 76, 1)', line=dict(color='rgba(236, 197, 76, 1)')),
-               dict(color='rgba(236, 197, 76, 0.7)', line=dict(color='rgba(236, 197, 76, 0.7)')),
-               dict(color='rgba(236, 197, 76, 0.4)', line=dict(color='rgba(236, 197, 76, 0.4)')),
-               ]
+def get_Bar_interest(index, df_schedule, width=None):
     fig = go.Bar(name='Loan{} Interest'.format(index + 1),
                  x=df_schedule['Payment Number'],
                  y=df_schedule['Applied Interest'],
-                 marker=palette[index],
+                 width=width,
+                 marker=INTEREST_PALETTE[index],
                  legendgroup=index,
                  )
     return fig
 
 
-@app.callback([Output('schedule', 'figure'),
-               Output('impact_banner', 'children'),
-               Output('store_df_impact', 'data'),
-               ],
-              [Input('contribution_checklist', 'value')],
-              [State('apply-store', 'data')],
-              prevent_initial_call=True)
-def update_schedule_figure(checklist_value, loans_data):
-    # print(checklist_value)
+def get_Scattergl_layer(name, index, x, top, value, color, fill):
+    # stacked step area drawn with WebGL, hover shows the layer's own value rather than the stack height
+    fig = go.Scattergl(name=name,
+                       x=x,
+                       y=top,
+                       customdata=value,
+                       mode='lines',
+                       line=dict(shape='hv', width=0, color=color),
+                       fill=fill,
+                       fillcolor=color,
+                       hovertemplate='%{customdata:.2f}',
+                       legendgroup=index,
+                       )
+    return fig
 
-    loans = loans_data
 
-    principal = [i['principal'] for i in loans]
-    rate = [i['rate'] for i in loans]
-    payment = [i['payment'] for i in loans]
-    extra_payment = [i['extra'] for i in loans]
-    if_contribution = any([sum(i.values()) for i in [loan['contribution'] for loan in loans]])
-    if if_contribution:
-        contribution = [i['contribution'] for i in loans]
-    else:
-        contribution = None
+def schedule_bucket(first, last):
+    """ Return the number of months per bucket that shows payments first to last in at most SCHEDULE_MAX_BUCKETS.
+    """
+    span = last - first + 1
+    for bucket in SCHEDULE_BUCKETS:
+        if span <= bucket * SCHEDULE_MAX_BUCKETS:
+            return bucket
+    return 12 * math.ceil(span / (12 * SCHEDULE_MAX_BUCKETS))
 
-    # Compute contribution impact if any
-    if contribution != None:
-        loan_impacts = LoanImpacts(principal=principal, rate=rate, payment=payment,
-                                   extra_payment=extra_payment, contributions=contribution)
-        df_impact = loan_impacts.compute_impacts()
-        store_df_impact = df_impact.to_json()
+
+def visible_payments(relayout_data, length):
+    """ Return the first and last payment numbers within the x-axis range of relayoutData, all payments if no range.
+    """
+    if relayout_data and 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        x0, x1 = relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    elif relayout_data and 'xaxis.range' in relayout_data:
+        x0, x1 = relayout_data['xaxis.range']
     else:
-        store_df_impact = ''
+        return 1, length
+    first = min(max(1, int(math.floor(x0))), length)
+    return first, max(first, min(length, int(math.ceil(x1))))
+
+
+def bin_schedules(loans, first, last, bucket):
+    """ Sum the applied principal and interest of each loan over buckets of payments, on a grid shared by all loans.
+    :return: first payment number of each bucket, list of (applied principal, applied interest) sums for each loan
+    """
+    start = (first - 1) // bucket * bucket
+    edges = np.arange(start, last, bucket)
+    binned = []
+    for loan in loans:
+        sums = []
+        for column in (loan.schedule.applied_principal, loan.schedule.applied_interest):
+            padded = np.zeros(last - start)
+            window = column[start:last]
+            padded[:len(window)] = window
+            sums.append(np.add.reduceat(padded, edges - start) if len(edges) > 0 else padded)
+        binned.append(sums)
+    return edges + 1, binned
+
+
+@metrics.timed('algorithm_seconds', function='get_schedule_fig')
+def get_schedule_fig(loans, relayout_data=None):
+    """ Draw the stacked schedule of the loans, binned so that the figure size is bounded whatever the term.
+    :param loans: loans with computed schedules
+    :param relayout_data: relayoutData of the schedule graph, only payments within its x-axis range are drawn
+    :return: figure
+    """
+    length = max([len(loan.schedule) for loan in loans], default=0)
+    first, last = visible_payments(relayout_data, length)
+    bucket = schedule_bucket(first, last)
+    x, binned = bin_schedules(loans, first, last, bucket)
+
+    if 2 * len(loans) * len(x) > SCHEDULE_WEBGL_POINTS:
+        layers = [('Principal', index, PRINCIPAL_PALETTE, sums[0]) for index, sums in enumerate(binned)] + \
+                 [('Interest', index, INTEREST_PALETTE, sums[1]) for index, sums in enumerate(binned)]
+        step_x = np.append(x, x[-1] + bucket)
+        data = []
+        base = np.zeros(len(x))
+        for kind, index, palette, value in layers:
+            top = base + value
+            data.append(get_Scattergl_layer('Loan{} {}'.format(index + 1, kind), index, step_x,
+                                            np.append(top, top[-1]), np.round(np.append(value, value[-1]), 2),
+                                            palette[index]['color'], 'tonexty' if len(data) > 0 else 'tozeroy'))
+            base = top
+    else:
+        center = x + (bucket - 1) / 2.0
+        width = bucket if bucket > 1 else None
+        df_schedules = [{'Payment Number': center, 'Applied Principal': np.round(sums[0], 2),
+                         'Applied Interest': np.round(sums[1], 2)} for sums in binned]
+        data = [get_Bar_principal(index, df_schedule, width) for index, df_schedule in enumerate(df_schedules)] + \
+               [get_Bar_interest(index, df_schedule, width) for index, df_schedule in enumerate(df_schedules)]
+
+    fig = go.Figure(data=data)
+    fig.update_layout(  # margin={"t": 0, "r": 0.4, "b": 0, "l": 0},  #################
+        margin=dict(l=0, r=0, b=0, t=30),
+        barmode='stack',
+        bargap=0,
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        xaxis=dict(title="<b>Schedule</b>" if bucket == 1 else "<b>Schedule ({}-month totals)</b>".format(bucket),
+                   showgrid=False),  # Time to loan termination
+        yaxis=dict(title="<b>USD</b>", showgrid=False),
+        legend=dict(xanchor='left', x=0 if len(loans) == 3 else 0, y=-0.25, orientation='h'),
+        hovermode='x unified',
+        hoverlabel=dict(
+            bgcolor='rgba(255, 255, 255, 0.9)',
+            namelength=-1
+        ),
+    )
+    return fig
+
+
+@metrics.timed('algorithm_seconds', function='compute_view')
+def compute_view(results, checklist_value):
+    """ Compute the schedule figure and impact banner shown for the checked contributors.
+    :param results: results of the applied loan data
+    :param checklist_value: value of contribution_checklist
+    :return: dictionary of the loans, figure and banner
+    """
+    principal = results['principal']
+    rate = results['rate']
+    payment = results['payment']
+    extra_payment = results['extra_payment']
+    contribution = results['contribution']
+    df_impact = results['df_impact']
+    checklist_value = sorted(checklist_value or [])
 
     # Get a impact banner according to checklist_value
-    # for i in range(len(principal)):
     if contribution != None:
         if len(checklist_value) != 0:
-            checklist_value.sort()
             if len(checklist_value) == len(contribution[0]):
                 impact_banner = 'With all the contribution, you only need to pay ${} interest in total. The loan term is {}.'.format(
                     *df_impact[df_impact['Index'] == 'ALL'].iloc[0][['InterestPaid', 'Duration']])
@@ -608,52 +886,50 @@ def update_schedule_figure(checklist_value, loans_data):
     else:
         impact_banner = None
 
-    # Compute the portfolio schedule according to checklist_value
-    loan_portfolio = LoanPortfolio()
-
+    # Compute the loans according to checklist_value
+    loans = []
     for i in range(len(principal)):
         if contribution != None:
-            if len(checklist_value) != 0:
-                loan = Loan(principal=principal[i], rate=rate[i],
-                            payment=payment[i], extra_payment=extra_payment[i] + sum(
-                        [contribution[i][member] for member in checklist_value]))
-            else:
-                loan = Loan(principal=principal[i], rate=rate[i],
-                            payment=payment[i], extra_payment=extra_payment[i])
+            extra = extra_payment[i] + sum([contribution[i][member] for member in checklist_value])
         else:
-            loan = Loan(principal=principal[i], rate=rate[i],
-                        payment=payment[i], extra_payment=extra_payment[i])
-        loan.check_loan_parameters()
-        loan.compute_schedule()
-        loan_portfolio.add_loan(loan)
+            extra = extra_payment[i]
+        loans.append(schedule_cache.get_loan(principal=principal[i], rate=rate[i], payment=payment[i],
+                                             extra_payment=extra))
+
+    fig = get_schedule_fig(loans)
+    fig.update_layout(uirevision='{}-{}'.format(results['key'], ' and '.join(checklist_value)))
+    return {'loans': loans, 'figure': fig, 'banner': impact_banner}
+
+
+@callback([Output('schedule', 'figure'),
+           Output('impact_banner', 'children'),
+           Output('store_df_impact', 'data'),
+           ],
+          [Input('contribution_checklist', 'value'),
+           Input('schedule', 'relayoutData')],
+          [State('apply-store', 'data')],
+          prevent_initial_call=True)
+def update_schedule_figure(checklist_value, relayout_data, loans_data):
+    # print(checklist_value)
 
-    loan_portfolio.aggregate()
+    # zooming only re-bins the figure, other relayout events (autosize, y-axis) need no update
+    zoom = [i['prop_id'] for i in dash.callback_context.triggered] == ['schedule.relayoutData']
+    if zoom and not any(prop.startswith('xaxis.') for prop in relayout_data or {}):
+        raise PreventUpdate
 
-    df_schedules = [Helper.schedule_as_df(loan) for loan in loan_portfolio.loans]
+    key, results = get_results(loans_data)
 
-    # Draw schedule plot
-    fig = go.Figure(
-        data=[get_Bar_principal(index, df_schedule.round(2)) for index, df_schedule in enumerate(df_schedules)] + \
-             [get_Bar_interest(index, df_schedule.round(2)) for index, df_schedule in enumerate(df_schedules)]
-    )
+    # Contribution impact if any
+    store_df_impact = key if results['contribution'] != None else ''
+    view = get_view(results, checklist_value)
 
-    fig.update_layout(  # margin={"t": 0, "r": 0.4, "b": 0, "l": 0},  #################
-        margin=dict(l=0, r=0, b=0, t=30),
-        barmode='stack',
-        bargap=0,
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        xaxis=dict(title="<b>Schedule</b>", showgrid=False),  # Time to loan termination
-        yaxis=dict(title="<b>USD</b>", showgrid=False),
-        legend=dict(xanchor='left', x=0 if len(df_schedules) == 3 else 0, y=-0.25, orientation='h'),
-        hovermode='x unified',
-        hoverlabel=dict(
-            bgcolor='rgba(255, 255, 255, 0.9)',
-            namelength=-1
-        ),
-    )
+    # Draw schedule plot, the zoom is kept until the data or checklist changes
+    if zoom:
+        fig = get_schedule_fig(view['loans'], relayout_data)
+        fig.update_layout(uirevision=view['figure'].layout.uirevision)
+        return fig, dash.no_update, dash.no_update
 
-    return fig, impact_banner, store_df_impact
+    return view['figure'], view['banner'], store_df_impact
 
 
 # %% Show contribution
@@ -690,14 +966,15 @@ def get_contribution_fig(df_impact):
     return fig
 
 
-@app.callback([Output('contribution', 'figure'),
-               Output('graph-switch-btn', 'style')],
-              [Input('store_df_impact', 'modified_timestamp')],
-              [State('store_df_impact', 'data')],
-              prevent_initial_call=True)
-def contribution_figure(modified_timestamp, store_df_impact):
+@callback([Output('contribution', 'figure'),
+           Output('graph-switch-btn', 'style')],
+          [Input('store_df_impact', 'modified_timestamp')],
+          [State('store_df_impact', 'data'),
+           State('apply-store', 'data')],
+          prevent_initial_call=True)
+def contribution_figure(modified_timestamp, store_df_impact, loans_data):
     if store_df_impact != '':
-        df_impact = pd.DataFrame(json.loads(store_df_impact))
+        df_impact = get_results(loans_data)[1]['df_impact']
         df_impact = df_impact[['Index', 'InterestPaid', 'Duration']]
         df_impact = df_impact[df_impact['Index'].str.contains('and') == False]
         df_impact = df_impact.sort_values('InterestPaid')
@@ -709,29 +986,18 @@ def contribution_figure(modified_timestamp, store_df_impact):
     return fig, style
 
 
-@app.callback([Output('contribution', 'style'),
-               Output('graph-schedule', 'style')],
-              [Input('graph-switch-btn', 'n_clicks')],
-              [State('graph-schedule', 'style'),
-               State('contribution', 'style')],
-              prevent_initial_call=True)
-def figure_switch(n_clicks, schedule_style, contribution_style):
-    if n_clicks == 1:
-        return {'display': 'flex', 'animation': 'appear 0.5s ease'}, {'display': 'none'}
-    if n_clicks:
-        if schedule_style == {'display': 'none'}:
-            schedule_style = {'display': 'flex'}
-        else:
-            schedule_style = {'display': 'none'}
-        if contribution_style == {'display': 'none'}:
-            contribution_style = {'display': 'flex'}
-        else:
-            contribution_style = {'display': 'none'}
-        return contribution_style, schedule_style
+clientside_callback(
+    ClientsideFunction(namespace='ui', function_name='figure_switch'),
+    [Output('contribution', 'style'),
+     Output('graph-schedule', 'style')],
+    [Input('graph-switch-btn', 'n_clicks')],
+    [State('graph-schedule', 'style'),
+     State('contribution', 'style')],
+    prevent_initial_call=True)
 
 
 # %% Schedule Table
-@app.callback(
+@callback(
     [
         Output('dropdown_schedule', 'options'),
         Output('dropdown_schedule', 'value')
@@ -746,32 +1012,158 @@ def choose_loan_to_show_schedule(modified_timestamp, loans_data):
     return options, value
 
 
-@app.callback([Output('table_schedule', 'columns'),
-               Output('table_schedule', 'data')],
-              [Input('apply-store', 'modified_timestamp'),
-               Input('dropdown_schedule', 'value')],
-              [State('apply-store', 'data')],
-              prevent_initial_call=True)
-def schedule_table(modified_timestamp, dropdown_value, loans_data):
-    columns = ['Payment Number', 'Begin Principal', 'Payment', 'Extra Payment',
-               'Applied Principal', 'Applied Interest', 'End Principal']
-    columns = [{"name": i, "id": i} for i in columns]
+FILTER_OPERATORS = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='], ['eq ', '=']]
+
+
+def split_filter_part(filter_part):
+    """ Split one part of a DataTable filter query into column name, operator and value.
+    :param filter_part: filter query part such as '{Payment} >= 300'
+    :return: column name, operator as in Helper.FILTER_OPERATORS, value; None for each if not a comparison
+    """
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+                value_part = value_part.strip().strip('"\'`')
+                try:
+                    return name, operator_type[1], float(value_part)
+                except ValueError:
+                    return None, None, None
+    return None, None, None
+
+
+@callback([Output('table_schedule', 'columns'),
+           Output('table_schedule', 'data'),
+           Output('table_schedule', 'page_count')],
+          [Input('apply-store', 'modified_timestamp'),
+           Input('dropdown_schedule', 'value'),
+           Input('table_schedule', 'page_current'),
+           Input('table_schedule', 'page_size'),
+           Input('table_schedule', 'sort_by'),
+           Input('table_schedule', 'filter_query')],
+          [State('apply-store', 'data')],
+          prevent_initial_call=True)
+def schedule_table(modified_timestamp, dropdown_value, page_current, page_size, sort_by, filter_query, loans_data):
+    columns = [{"name": i, "id": i, "type": "numeric"} for i in Schedule.COLUMNS]
+    # the browser formats the full values, rounded to cents with thousands separators
+    for column in columns[1:]:
+        column['format'] = Format(precision=2, scheme=Scheme.fixed, group=Group.yes)
+
+    # only the requested page is sent to the browser
+    filters = []
+    for part in filter(None, (filter_query or '').split(' && ')):
+        name, operator, value = split_filter_part(part)
+        if name in [column['id'] for column in columns]:
+            filters.append((name, operator, value))
+        else:
+            # the table only builds numeric comparisons, anything else is typed by hand and matches every row
+            logger.debug('ignoring schedule table filter %r', part)
+    sort_by = [(sort['column_id'], sort['direction'] == 'asc') for sort in sort_by or []]
+    page_current = page_current or 0
+
+    loans_schedule = get_results(loans_data)[1]['schedules']
+    with metrics.time('algorithm_seconds', function='Helper.schedule_page'):
+        selected_schedule, row_count = Helper.schedule_page(loans_schedule[dropdown_value], page_current, page_size,
+                                                            sort_by=sort_by, filters=filters, digits=2)
+        page_count = max(1, -(-row_count // page_size))
+        # the page is reset in the browser when the rows change, this only serves a page number already past the end
+        if page_current >= page_count:
+            selected_schedule, row_count = Helper.schedule_page(loans_schedule[dropdown_value], page_count - 1,
+                                                                page_size, sort_by=sort_by, filters=filters, digits=2)
+
+    return columns, selected_schedule, page_count
+
+
+clientside_callback(
+    ClientsideFunction(namespace='ui', function_name='first_page'),
+    Output('table_schedule', 'page_current'),
+    [Input('apply-store', 'modified_timestamp'),
+     Input('dropdown_schedule', 'value'),
+     Input('table_schedule', 'filter_query')],
+    [State('table_schedule', 'page_current')],
+    prevent_initial_call=True)
 
-    loans = LoanPortfolio()
-    loans_schedule = {}
-    for index, loan_data in enumerate(loans_data):
-        loan = Loan(principal=loan_data['principal'], rate=loan_data['rate'], payment=loan_data['payment'],
-                    extra_payment=loan_data['extra'] + sum(loan_data['contribution'].values()))
-        loan.compute_schedule()
-        loans.add_loan(loan)
-        loans_schedule['loan{}'.format(index + 1)] = Helper.schedule_as_df(loan)
-    loans.aggregate()
-    loans_schedule['portfolio'] = Helper.schedule_as_df(loans)
 
-    selected_schedule = loans_schedule[dropdown_value].round(2)
-    selected_schedule = selected_schedule.to_dict('records')
+# %% Export
+EXPORT_FORMATS = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+
+def export_href(path, loans_data):
+    """ Return the relative link of an export, carrying the loan data so that any worker can serve it.
+    """
+    return '{}?{}'.format(path, urllib.parse.urlencode({'data': json.dumps(loans_data, separators=(',', ':'))}))
+
+
+@callback([Output('download-schedule-csv', 'href'),
+           Output('download-schedule-parquet', 'href'),
+           Output('download-impacts-csv', 'href'),
+           Output('download-impacts-csv', 'style')],
+          [Input('dropdown_schedule', 'value'),
+           Input('apply-store', 'modified_timestamp')],
+          [State('apply-store', 'data')],
+          prevent_initial_call=True)
+def export_links(dropdown_value, modified_timestamp, loans_data):
+    if not loans_data or dropdown_value is None:
+        raise PreventUpdate
+    if_contribution = any([sum(i.values()) for i in [loan['contribution'] for loan in loans_data]])
+    return export_href('export/schedule/{}.csv'.format(dropdown_value), loans_data), \
+           export_href('export/schedule/{}.parquet'.format(dropdown_value), loans_data), \
+           export_href('export/impacts.csv', loans_data), \
+           {'display': 'inline-block'} if if_contribution else {'display': 'none'}
+
+
+def register_export_routes(app):
+    """ Serve the schedules and impacts of applied loan data as CSV or Parquet downloads. Schedules are streamed
+    chunk by chunk from the cached schedule columns.
+    :param app: Dash app
+    """
+    def exported_results():
+        # links can be forged, only data that on_click could have applied is computed
+        try:
+            loans_data = json.loads(flask.request.args['data'])
+        except (KeyError, ValueError):
+            loans_data = None
+        if not valid_loans_data(loans_data):
+            flask.abort(400, 'Invalid loan data')
+        return get_results(loans_data)[1]
+
+    def download(chunks, name, file_format):
+        if file_format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+            flask.abort(501, 'Parquet export requires pyarrow')
+        response = flask.Response(flask.stream_with_context(chunks), mimetype=EXPORT_FORMATS[file_format])
+        response.headers['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(name, file_format)
+        return response
+
+    @app.server.route(app.config.routes_pathname_prefix + 'export/schedule/<name>.<file_format>')
+    def export_schedule(name, file_format):
+        schedules = exported_results()['schedules']
+        if name not in schedules or file_format not in EXPORT_FORMATS:
+            flask.abort(404)
+        schedule = schedules[name].schedule
+        # generators: nothing is computed before the download starts
+        if file_format == 'csv':
+            chunks = Helper.iter_csv(schedule)
+        else:
+            chunks = Helper.iter_parquet(schedule)
+        return download(chunks, 'schedule-{}'.format(name), file_format)
+
+    @app.server.route(app.config.routes_pathname_prefix + 'export/impacts.<file_format>')
+    def export_impacts(file_format):
+        df_impact = exported_results()['df_impact']
+        if df_impact is None or file_format not in EXPORT_FORMATS:
+            flask.abort(404)
+
+        # a generator, like the schedule exports: download() checks for pyarrow before any bytes are built
+        def chunks():
+            if file_format == 'csv':
+                yield df_impact.to_csv(index=False)
+            else:
+                buffer = io.BytesIO()
+                df_impact.to_parquet(buffer, index=False)
+                yield buffer.getvalue()
 
-    return columns, selected_schedule
+        return download(chunks(), 'impacts', file_format)
 
 
 # %%
@@ -780,7 +1172,7 @@ def schedule_table(modified_timestamp, dropdown_value, loans_data):
 
 # <editor-fold desc="app-layout">
 
-app.layout = html.Div(
+layout = html.Div(
     [
         dcc.Store(id="apply-store"),
         dcc.Store(id='loan-number'),
@@ -863,8 +1255,26 @@ app.layout = html.Div(
                 html.Div(
                     [
                         dcc.RadioItems(id='dropdown_schedule'),
+                        html.Div(
+                            [
+                                'Download\u00a0',
+                                dbc.Button('CSV', id='download-schedule-csv', href='', external_link=True,
+                                           color='dark', outline=True, size='sm', className='mr-1'),
+                                dbc.Button('Parquet', id='download-schedule-parquet', href='', external_link=True,
+                                           color='dark', outline=True, size='sm', className='mr-1'),
+                                dbc.Button('Impacts CSV', id='download-impacts-csv', href='', external_link=True,
+                                           color='dark', outline=True, size='sm', style={'display': 'none'}),
+                            ], className='download-group'),
                         html.Div(dash_table.DataTable(
                             id='table_schedule',
+                            page_action='custom',
+                            page_current=0,
+                            page_size=24,
+                            sort_action='custom',
+                            sort_mode='single',
+                            sort_by=[],
+                            filter_action='custom',
+                            filter_query='',
                             style_table={'overflowY': 'auto'},
                             style_cell={'textOverflow': 'ellipsis', },
                             style_header={'bacgroundColor': 'white', 'fontWeight': 'bold'},
@@ -876,8 +1286,24 @@ app.layout = html.Div(
             className='app-row-3', id='row-3', style={'display': 'none'}),
     ], className='app-body'
 )
+# </editor-fold>
 
-app.run_server(debug=False, use_reloader=False)
 # </editor-fold>
 
-# </editor-fold>
\ No newline at end of file
+
+def create_app():
+    """ Create the Dash app with its layout and callbacks. Caches are shared by all apps of a process.
+    :return: Dash app, serve app.server with a WSGI server, see wsgi.py
+    """
+    app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+    app.config.suppress_callback_exceptions = True
+    app.layout = layout
+    register_callbacks(app)
+    register_metrics(app)
+    register_export_routes(app)
+    return app
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s %(message)s')
+    create_app().run_server(debug=False, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,70 @@
+// Clientside callbacks for UI state only, run in the browser without a round trip to the server
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    ui: {
+        // show the inputs of the selected number of loans and contributors
+        loan_num: function (n, back, nxt, reset_n, last_history) {
+            const vis = {'display': 'block'};
+            const invis = {'display': 'none'};
+            const triggered = dash_clientside.callback_context.triggered.map(t => t.prop_id.split('.')[0]);
+
+            // if last_history store is None
+            if (!last_history) {
+                return [{'num': 1, 'back': 0, 'next': 0}].concat(Array(11).fill(invis));
+            }
+            last_history = Object.assign({}, last_history);
+            if (triggered.includes('reset-button')) {
+                last_history['num'] = 1;
+                return [last_history].concat(Array(11).fill(invis));
+            }
+
+            if (back > last_history['back']) {
+                last_history['back'] = back;
+                last_history['num'] = Math.max(1, last_history['num'] - 1);
+            } else if (nxt > last_history['next']) {
+                last_history['next'] = nxt;
+                last_history['num'] = Math.min(3, last_history['num'] + 1);
+            }
+            const loan_2 = last_history['num'] >= 2 ? vis : invis;
+            const loan_3 = last_history['num'] === 3 ? vis : invis;
+            const contribute_1 = n ? vis : invis;
+            const contribute_2 = n && last_history['num'] >= 2 ? vis : invis;
+            const contribute_3 = n && last_history['num'] === 3 ? vis : invis;
+            const contribute_b = n >= 2 ? vis : invis;
+            const contribute_c = n >= 3 ? vis : invis;
+            return [last_history, loan_2, loan_3, contribute_1, contribute_2, contribute_3, contribute_b, contribute_b,
+                contribute_b, contribute_c, contribute_c, contribute_c];
+        },
+
+        // clear every loan input
+        reset_inputs: function (n) {
+            return Array(21).fill(null);
+        },
+
+        // reset the contribution number and applied data
+        reset: function (n) {
+            if (n) {
+                return [0, 0];
+            }
+            return [dash_clientside.no_update, dash_clientside.no_update];
+        },
+
+        // go back to the first page of the schedule table when its rows change
+        first_page: function (modified_timestamp, dropdown_value, filter_query, page_current) {
+            return page_current ? 0 : dash_clientside.no_update;
+        },
+
+        // toggle between the schedule and contribution figures
+        figure_switch: function (n_clicks, schedule_style, contribution_style) {
+            if (n_clicks === 1) {
+                return [{'display': 'flex', 'animation': 'appear 0.5s ease'}, {'display': 'none'}];
+            }
+            if (n_clicks) {
+                const hidden = style => style && style['display'] === 'none' && Object.keys(style).length === 1;
+                schedule_style = hidden(schedule_style) ? {'display': 'flex'} : {'display': 'none'};
+                contribution_style = hidden(contribution_style) ? {'display': 'flex'} : {'display': 'none'};
+                return [contribution_style, schedule_style];
+            }
+            return [dash_clientside.no_update, dash_clientside.no_update];
+        }
+    }
+});
@@ -0,0 +1,75 @@
+""" Startup benchmark: import time and resident memory of the algorithms modules and the app.
+Each module is imported in a fresh interpreter, so results include everything the import pulls in. Run from anywhere:
+    python benchmarks/startup.py [--repeat 5] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ['algorithms.Amortization', 'algorithms.Loan', 'algorithms.LoanBatch', 'algorithms.LoanPortfolio',
+           'algorithms.LoanImpacts', 'algorithms.Helper', 'app', 'wsgi']
+
+# heavy optional libraries that the app should not load at startup
+HEAVY_MODULES = ['matplotlib', 'prettytable', 'pandas']
+
+PROBE = """
+import json, sys, time
+def rss():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+before = rss()
+start = time.perf_counter()
+__import__(sys.argv[1])
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'rss': rss(), 'rss_delta': rss() - before,
+                  'heavy': [name for name in sys.argv[2:] if name in sys.modules]}))
+"""
+
+
+def measure(module, repeat):
+    """ Import a module in fresh interpreters.
+    :param module: module name
+    :param repeat: number of interpreters
+    :return: dictionary of median import seconds, resident memory, and heavy modules loaded
+    """
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', PROBE, module] + HEAVY_MODULES, cwd=ROOT, check=True,
+                                capture_output=True, text=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {'module': module,
+            'seconds': statistics.median(run['seconds'] for run in runs),
+            'rss': statistics.median(run['rss'] for run in runs),
+            'rss_delta': statistics.median(run['rss_delta'] for run in runs),
+            'heavy': runs[-1]['heavy']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('modules', nargs='*', default=MODULES, help='modules to import')
+    parser.add_argument('--repeat', type=int, default=5, help='interpreters per module, the median is reported')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    results = [measure(module, args.repeat) for module in args.modules]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print('{:<26}{:>12}{:>12}{:>12}  {}'.format('module', 'import ms', 'RSS MiB', '+RSS MiB', 'heavy modules'))
+    for result in results:
+        print('{:<26}{:>12.1f}{:>12.1f}{:>12.1f}  {}'.format(result['module'], result['seconds'] * 1e3,
+                                                             result['rss'] / 2 ** 20, result['rss_delta'] / 2 ** 20,
+                                                             ', '.join(result['heavy']) or '-'))
+
+
+if __name__ == '__main__':
+    main()
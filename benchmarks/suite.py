@@ -0,0 +1,170 @@
+""" Benchmark suite of the algorithms package, with results compared against a stored baseline.
+    python benchmarks/suite.py                    # run every benchmark and compare with benchmarks/baseline.json
+    python benchmarks/suite.py --save-baseline    # run and store the results as the new baseline
+    python benchmarks/suite.py -k impacts --json results.json
+Exits with status 1 when a benchmark's median is slower than its baseline's by more than the threshold and even its
+best run is slower than the slowest baseline run, so that run-to-run noise is not reported as a regression.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from algorithms.Helper import Helper
+from algorithms.Loan import Loan
+from algorithms.LoanImpacts import LoanImpacts
+from algorithms.LoanPortfolio import LoanPortfolio
+
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+TERMS = [12, 120, 360, 1200]
+PORTFOLIO_SIZES = [1, 10, 100, 1000]
+CONTRIBUTOR_COUNTS = [1, 3, 6, 10]
+
+
+def payment_for_term(principal, rate, term):
+    """ Return the payment that pays off a loan in the given number of months.
+    """
+    r = rate / 1200.0
+    return principal * r / (1.0 - (1.0 + r) ** -term)
+
+
+def loan_for_term(term, principal=100000.0, rate=6.0, compute=True):
+    """ Return a loan paid off in the given number of months, with its schedule computed if compute is True.
+    """
+    loan = Loan(principal=principal, rate=rate, payment=round(payment_for_term(principal, rate, term), 2) + 0.01)
+    if compute:
+        loan.compute_schedule()
+    return loan
+
+
+def benchmarks():
+    """ Return every benchmark as (name, setup) pairs, setup returns the function to time.
+    """
+    cases = []
+    for term in TERMS:
+        for engine in ['vectorized', 'loop']:
+            def setup(term=term, engine=engine):
+                loan = loan_for_term(term, compute=False)
+                return lambda: loan.compute_schedule(engine=engine)
+            cases.append((f'loan.compute_schedule[{engine}-term{term}]', setup))
+
+    for size in PORTFOLIO_SIZES:
+        def setup(size=size):
+            portfolio = LoanPortfolio()
+            for i in range(size):
+                portfolio.add_loan(loan_for_term(TERMS[i % len(TERMS)], principal=10000.0 + i))
+            return portfolio.aggregate
+        cases.append((f'portfolio.aggregate[loans{size}]', setup))
+
+    for count in CONTRIBUTOR_COUNTS:
+        def setup(count=count):
+            members = [chr(ord('A') + i) for i in range(count)]
+            impacts = LoanImpacts(principal=[100000.0, 20000.0, 5000.0], rate=[6.0, 4.5, 12.0],
+                                  payment=[700.0, 400.0, 200.0], extra_payment=[0.0, 10.0, 0.0],
+                                  contributions=[{member: 5.0 * (i + 1) for i, member in enumerate(members)}
+                                                 for _ in range(3)])
+            return impacts.compute_impacts
+        cases.append((f'impacts.compute_impacts[contributors{count}]', setup))
+
+    for term in [360, 1200]:
+        for records in [False, True]:
+            def setup(term=term, records=records):
+                loan = loan_for_term(term)
+                return lambda: Helper.schedule_as_df(loan, records=records, digits=2)
+            cases.append((f'helper.schedule_as_df[{"records" if records else "frame"}-term{term}]', setup))
+        for writer in ['iter_csv', 'iter_table']:
+            def setup(term=term, writer=writer):
+                loan = loan_for_term(term)
+                return lambda: ''.join(getattr(Helper, writer)(loan.schedule))
+            cases.append((f'helper.{writer}[term{term}]', setup))
+    return cases
+
+
+def run(name, setup, repeat, min_time):
+    """ Time a benchmark: the number of calls per run is calibrated to last at least min_time seconds.
+    :return: dictionary of the best, median and worst seconds per call over repeat runs
+    """
+    function = setup()
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    times = sorted(t / number for t in timer.repeat(repeat=repeat, number=number))
+    return {'name': name, 'best': times[0], 'median': times[len(times) // 2], 'worst': times[-1], 'number': number,
+            'repeat': repeat}
+
+
+def is_regression(result, base, threshold):
+    """ Return True if the median is slower than the baseline median by more than threshold, and the slowdown is
+    larger than the spread of the runs: the best run is slower than the worst baseline run.
+    """
+    return result['median'] / base['median'] > threshold and result['best'] > base.get('worst', base['median'])
+
+
+def compare(results, baseline, threshold, file=sys.stdout):
+    """ Compare median times with the baseline, printing a report to file.
+    :return: names of the benchmarks slower than the baseline, see is_regression
+    """
+    regressions = []
+    print('{:<52}{:>14}{:>14}{:>9}'.format('benchmark', 'median', 'baseline', 'ratio'), file=file)
+    for result in results:
+        base = baseline.get(result['name'])
+        ratio = result['median'] / base['median'] if base else None
+        flag = ''
+        if base and is_regression(result, base, threshold):
+            regressions.append(result['name'])
+            flag = '  REGRESSION'
+        print('{:<52}{:>11.1f} us{:>11} us{:>9}{}'.format(
+            result['name'], result['median'] * 1e6, '{:.1f}'.format(base['median'] * 1e6) if base else '-',
+            '{:.2f}'.format(ratio) if ratio is not None else '-', flag), file=file)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-k', dest='keyword', default='', help='only run benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=7, help='timed runs per benchmark')
+    parser.add_argument('--min-time', type=float, default=0.2, help='minimum seconds per timed run')
+    parser.add_argument('--json', dest='output', help='write the results as JSON to this file, - for stdout')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown ratio of the median time above which a benchmark is a regression')
+    args = parser.parse_args()
+
+    results = [run(name, setup, args.repeat, args.min_time) for name, setup in benchmarks() if args.keyword in name]
+    report = {'python': platform.python_version(), 'machine': platform.machine(), 'results': results}
+
+    if args.output == '-':
+        print(json.dumps(report, indent=2))
+    elif args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = {result['name']: result for result in json.load(f)['results']}
+    regressions = compare(results, baseline, args.threshold, sys.stderr if args.output == '-' else sys.stdout)
+
+    if args.save_baseline:
+        # keep the baseline of benchmarks that were not run
+        baseline.update({result['name']: result for result in results})
+        report['results'] = list(baseline.values())
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Baseline saved to', args.baseline, file=sys.stderr)
+    elif regressions:
+        print('{} regression(s) above {:.2f}x: {}'.format(len(regressions), args.threshold, ', '.join(regressions)),
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+# Gunicorn settings, read by default when running gunicorn from this directory:
+#     gunicorn wsgi:server
+# Every setting can be overridden with an environment variable of the same name in capitals, e.g. WORKERS=8.
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8050')
+
+# one process per core runs the NumPy computations in parallel, schedule and result caches are per worker
+workers = int(os.environ.get('WORKERS', multiprocessing.cpu_count()))
+
+# threads per worker serve the light callbacks (tables, cached figures) while another one computes
+threads = int(os.environ.get('THREADS', 4))
+worker_class = 'gthread'
+
+# import the app once in the master and fork the workers from it, so they share the loaded code and libraries
+preload_app = os.environ.get('PRELOAD_APP', 'true').lower() == 'true'
+
+# restart workers now and then so that long-running processes do not accumulate memory
+max_requests = int(os.environ.get('MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('MAX_REQUESTS_JITTER', 1000))
+timeout = int(os.environ.get('TIMEOUT', 120))
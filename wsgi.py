@@ -0,0 +1,8 @@
+# WSGI entry point, serve with gunicorn (settings in gunicorn.conf.py):
+#     gunicorn wsgi:server
+import logging
+from app import create_app
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s %(message)s')
+app = create_app()
+server = app.server